@@ -1,21 +1,974 @@
 # ai_core.py
+import argparse
+import itertools
+import json
+import os
 import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 try:
+    import httpx
     import ollama
 except ImportError:
     print("Missing dependency: ollama")
     print("Install with: pip install ollama")
     sys.exit(1)
 
+from circuit_breaker import CircuitBreaker, backoff_delay
+from metrics import MetricsStore, server_metrics
+from response_cache import ResponseCache
+from vector_memory import VectorMemory, inject_memories
 
-def get_model_response(messages: list, model_name: str = "llama3.2") -> str:
+
+CONNECTION_ERROR_REPLY = "I'm having trouble connecting to my brain right now."
+
+DEFAULT_SYSTEM_PROMPT = (
+    "You are a small, friendly desktop companion. "
+    "Keep your replies short and helpful."
+)
+# Token budget for the whole prompt (system prompt + history). Keeping this
+# bounded keeps prefill time flat however long the session runs.
+CONTEXT_TOKEN_BUDGET = 2048
+# Once over budget, trim down to this fraction of it. Trimming in larger steps
+# means the history prefix stays unchanged for several turns in a row, which
+# keeps the reusable model context (see ContextSession) valid.
+TRIM_TARGET_RATIO = 0.75
+# Rough per-message cost of the chat template (role markers, separators).
+MESSAGE_TOKEN_OVERHEAD = 4
+
+# Background compaction: once the history passes COMPACT_THRESHOLD_TOKENS,
+# everything but the newest COMPACT_KEEP_RECENT_TOKENS is replaced by a
+# model-written summary of at most SUMMARY_MAX_TOKENS.
+COMPACT_THRESHOLD_TOKENS = 1536
+COMPACT_KEEP_RECENT_TOKENS = 512
+SUMMARY_MAX_TOKENS = 256
+SUMMARY_PROMPT = (
+    "Summarize the conversation below for your own memory. Keep names, facts, "
+    "decisions and open questions; drop small talk. Write at most a short paragraph."
+)
+# A prefix whose summary failed is not retried before this delay (seconds),
+# doubling on every further failure up to COMPACT_RETRY_MAX_DELAY
+COMPACT_RETRY_DELAY = 30.0
+COMPACT_RETRY_MAX_DELAY = 600.0
+
+# Ollama server connection. OLLAMA_HOST overrides the default localhost:11434.
+OLLAMA_HOST = os.environ.get("OLLAMA_HOST")
+CONNECT_TIMEOUT = 3.0    # seconds to establish a connection
+READ_TIMEOUT = 120.0     # seconds to wait between bytes of a (streamed) reply
+MAX_CONNECTIONS = 4      # pooled keep-alive connections to the server
+HEALTH_CHECK_TIMEOUT = 2.0
+# Transient failures (unreachable server, timeouts, 5xx replies) are retried
+# with jittered exponential backoff. After BREAKER_FAILURE_THRESHOLD failures
+# in a row the server is considered down: requests fail immediately while a
+# background health probe waits for it to come back.
+RETRY_ATTEMPTS = 3
+RETRY_BASE_DELAY = 0.25  # seconds
+RETRY_MAX_DELAY = 2.0    # seconds
+BREAKER_FAILURE_THRESHOLD = 3
+BREAKER_PROBE_INTERVAL = 1.0      # first delay between health probes (seconds)
+BREAKER_PROBE_MAX_INTERVAL = 15.0
+# How long the server keeps the model loaded after each request.
+# Ollama accepts durations like "30m", -1 to keep it forever or 0 to unload.
+KEEP_ALIVE = "30m"
+# Model loads longer than this are reported as cold starts
+COLD_LOAD_THRESHOLD = 0.5
+# Tokens generated by a speculative prefill. Ollama treats num_predict=0 as
+# "no limit", so one token is the cheapest request that still evaluates the prompt.
+PREFILL_NUM_PREDICT = 1
+
+# Timing of the most recent requests, for percentile summaries and export
+METRICS_MAX_RECORDS = 500
+request_metrics = MetricsStore(METRICS_MAX_RECORDS)
+
+# Replies to identical requests are served from here instead of the model
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "responses")
+response_cache = ResponseCache(CACHE_DIR)
+
+# Long-term memory: past exchanges are embedded with EMBED_MODEL and the
+# MEMORY_TOP_K most similar ones (above MEMORY_MIN_SCORE) are added to prompts
+MEMORY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "memory")
+EMBED_MODEL = "nomic-embed-text"
+MEMORY_TOP_K = 3
+MEMORY_MIN_SCORE = 0.5
+
+# Model name -> seconds the server spent loading it for the latest request
+last_load_durations = {}
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Approximate the number of tokens in a piece of text.
+
+    Uses the usual ~4 characters per token rule, but never fewer tokens than
+    words, so short texts made of many tiny words are not undercounted.
+    """
+    if not text:
+        return 0
+    return max(len(text) // 4, len(text.split()), 1)
+
+
+def estimate_message_tokens(message: dict) -> int:
+    """Approximate the tokens a single chat message adds to the prompt."""
+    return estimate_tokens(message.get("content", "")) + MESSAGE_TOKEN_OVERHEAD
+
+
+class Conversation:
+    """Multi-turn chat history kept within a token budget.
+
+    The system prompt (and the summary of compacted turns, if any) is pinned
+    at the start of every message list. When the history grows past the
+    budget the oldest turns are evicted first.
+    """
+
+    def __init__(self, system_prompt=DEFAULT_SYSTEM_PROMPT, max_tokens=CONTEXT_TOKEN_BUDGET,
+                 trim_ratio=TRIM_TARGET_RATIO):
+        """
+        Args:
+            system_prompt: Pinned system prompt (None or "" for no system prompt)
+            max_tokens: Approximate token budget for the full message list
+            trim_ratio: Fraction of the budget to trim down to once it is exceeded
+        """
+        self.system_prompt = system_prompt
+        self.max_tokens = max_tokens
+        self.trim_ratio = trim_ratio
+        self.summary = ""  # model-written summary of compacted turns
+        self.turns = []  # user/assistant messages, oldest first
+        self.revision = 0  # bumped whenever earlier history is removed or replaced
+        self._lock = threading.Lock()
+
+    def _pinned_messages(self):
+        pinned = []
+        if self.system_prompt:
+            pinned.append({"role": "system", "content": self.system_prompt})
+        if self.summary:
+            pinned.append({
+                "role": "system",
+                "content": "Summary of the earlier conversation: " + self.summary,
+            })
+        return pinned
+
+    def _trim(self):
+        """Evict the oldest turns until the history fits the budget."""
+        pinned_tokens = sum(estimate_message_tokens(m) for m in self._pinned_messages())
+        total = sum(estimate_message_tokens(m) for m in self.turns)
+        if total <= self.max_tokens - pinned_tokens:
+            return
+
+        target = self.max_tokens * self.trim_ratio - pinned_tokens
+        evicted = False
+        # Always keep the newest message, even if it alone is over budget
+        while total > target and len(self.turns) > 1:
+            total -= estimate_message_tokens(self.turns.pop(0))
+            evicted = True
+            # Never start the history with a dangling assistant reply
+            while self.turns and self.turns[0]["role"] == "assistant" and len(self.turns) > 1:
+                total -= estimate_message_tokens(self.turns.pop(0))
+        if evicted:
+            self.revision += 1
+
+    def add_user(self, text):
+        """Append a user turn and trim the history."""
+        with self._lock:
+            self.turns.append({"role": "user", "content": text})
+            self._trim()
+
+    def add_assistant(self, text):
+        """Append an assistant turn and trim the history."""
+        with self._lock:
+            self.turns.append({"role": "assistant", "content": text})
+            self._trim()
+
+    def discard_pending(self):
+        """Drop a trailing user turn that never got a reply (e.g. after an error)."""
+        with self._lock:
+            if self.turns and self.turns[-1]["role"] == "user":
+                self.turns.pop()
+                self.revision += 1
+
+    def clear(self):
+        """Forget the whole history (the system prompt stays)."""
+        with self._lock:
+            self.turns = []
+            self.summary = ""
+            self.revision += 1
+
+    def messages(self):
+        """Return a copy of the message list to send to the model."""
+        with self._lock:
+            result = self._pinned_messages()
+            result.extend(dict(m) for m in self.turns)
+            return result
+
+    def token_count(self):
+        """Approximate token count of the current message list."""
+        return sum(estimate_message_tokens(m) for m in self.messages())
+
+    def snapshot(self):
+        """
+        Return (revision, pinned_messages, turns) as one consistent copy.
+
+        Turns are only ever appended while the revision stays the same, so a
+        (revision, turn count) pair identifies a history prefix.
+        """
+        with self._lock:
+            return self.revision, self._pinned_messages(), [dict(m) for m in self.turns]
+
+    def compaction_candidate(self, threshold_tokens=COMPACT_THRESHOLD_TOKENS,
+                             keep_recent_tokens=COMPACT_KEEP_RECENT_TOKENS):
+        """
+        Pick the older turns that should be folded into the summary.
+
+        Returns:
+            (previous_summary, prefix_turns) when the history is over
+            threshold_tokens, otherwise None. The prefix always ends with an
+            assistant reply so only complete exchanges are summarized.
+        """
+        with self._lock:
+            if self._token_count() <= threshold_tokens:
+                return None
+
+            # Keep the newest turns that fit in keep_recent_tokens
+            kept_tokens = 0
+            split = len(self.turns)
+            while split > 0:
+                cost = estimate_message_tokens(self.turns[split - 1])
+                if kept_tokens + cost > keep_recent_tokens:
+                    break
+                kept_tokens += cost
+                split -= 1
+            while split > 0 and self.turns[split - 1]["role"] != "assistant":
+                split -= 1
+            if split == 0:
+                return None
+            return self.summary, [dict(m) for m in self.turns[:split]]
+
+    def apply_summary(self, prefix_turns, summary):
+        """
+        Replace prefix_turns with summary, if the history still starts with them.
+
+        Returns:
+            True if the history was compacted, False if it changed meanwhile.
+        """
+        with self._lock:
+            count = len(prefix_turns)
+            if not summary or self.turns[:count] != prefix_turns:
+                return False
+            self.summary = summary.strip()
+            self.turns = self.turns[count:]
+            self.revision += 1
+            return True
+
+    def _token_count(self):
+        # Caller holds the lock
+        return sum(estimate_message_tokens(m) for m in self._pinned_messages() + self.turns)
+
+
+def build_summary_messages(previous_summary, turns):
+    """Build the message list that asks the model to summarize turns."""
+    transcript = []
+    if previous_summary:
+        transcript.append("Earlier summary: " + previous_summary)
+    for message in turns:
+        transcript.append(f"{message['role']}: {message['content']}")
+    return [
+        {"role": "system", "content": SUMMARY_PROMPT},
+        {"role": "user", "content": "\n".join(transcript)},
+    ]
+
+
+def render_transcript(turns):
+    """Flatten turns into a single prompt, for models fed through /api/generate."""
+    if len(turns) == 1:
+        return turns[0]["content"]
+    lines = []
+    for message in turns[:-1]:
+        speaker = "User" if message["role"] == "user" else "Assistant"
+        lines.append(f"{speaker}: {message['content']}")
+    lines.append("")
+    lines.append(turns[-1]["content"])
+    return "\n".join(lines)
+
+
+class ContextSession:
+    """Reuses the model's KV state between turns of one Conversation.
+
+    Ollama's generate endpoint returns a ``context`` (the token state of the
+    whole exchange). Sending it back with only the new user message lets the
+    server skip re-processing the earlier conversation. The context is only
+    reused while the history is exactly what it was built from plus the
+    assistant reply it produced; any trim, compaction, discard or model
+    change invalidates it and the next turn rebuilds it from the transcript.
+    """
+
+    def __init__(self):
+        self.context = None
+        self.model_name = None
+        self.revision = None
+        self.turn_count = 0
+        self.reused_turns = 0
+        self.rebuilt_turns = 0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self.context = None
+
+    def plan(self, conversation, model_name):
+        """
+        Build the generate request for the newest user turn of conversation.
+
+        Returns:
+            Dict with "prompt", "system", "context", "model", "revision",
+            "turn_count" and "reused" to pass to the engine.
+        """
+        revision, pinned, turns = conversation.snapshot()
+        with self._lock:
+            reusable = (
+                self.context is not None
+                and self.model_name == model_name
+                and self.revision == revision
+                and self.turn_count == len(turns) - 1
+                and turns and turns[-1]["role"] == "user"
+            )
+            if reusable:
+                # The server already holds everything but the new message
+                prompt, system, context = turns[-1]["content"], None, self.context
+            else:
+                system = "\n\n".join(m["content"] for m in pinned) or None
+                prompt, context = render_transcript(turns), None
+            return {
+                "prompt": prompt,
+                "system": system,
+                "context": context,
+                "model": model_name,
+                "revision": revision,
+                "turn_count": len(turns),
+                "reused": reusable,
+            }
+
+    def prefix_request(self, conversation, model_name):
+        """
+        Build the part of the next turn's request that is already known.
+
+        Returns:
+            Dict with "prompt", "system" and "context" covering the history
+            before the next user message, or None when the stored context
+            will be reused and there is nothing left to warm up.
+        """
+        revision, pinned, turns = conversation.snapshot()
+        with self._lock:
+            if (self.context is not None and self.model_name == model_name
+                    and self.revision == revision and self.turn_count == len(turns)):
+                return None
+        system = "\n\n".join(m["content"] for m in pinned) or None
+        prompt = render_transcript(turns + [{"role": "user", "content": ""}]) if turns else ""
+        return {"prompt": prompt, "system": system, "context": None}
+
+    def commit(self, plan, context):
+        """Store the context returned for a successfully answered plan."""
+        with self._lock:
+            if plan["reused"]:
+                self.reused_turns += 1
+            else:
+                self.rebuilt_turns += 1
+            if not context:
+                self.context = None
+                return
+            self.context = context
+            self.model_name = plan["model"]
+            self.revision = plan["revision"]
+            # The assistant reply is appended right after this
+            self.turn_count = plan["turn_count"] + 1
+
+
+class ConversationCompactor:
+    """Folds old turns of a Conversation into a summary while the user is idle.
+
+    The summary is produced by a low-priority engine job that is cancelled as
+    soon as a live request starts. Summaries are stored in the response
+    cache, so the same history prefix is never summarized twice.
+    """
+
+    def __init__(self, conversation, model_name="llama3.2",
+                 threshold_tokens=COMPACT_THRESHOLD_TOKENS,
+                 keep_recent_tokens=COMPACT_KEEP_RECENT_TOKENS,
+                 summary_max_tokens=SUMMARY_MAX_TOKENS):
+        self.conversation = conversation
+        self.model_name = model_name
+        self.threshold_tokens = threshold_tokens
+        self.keep_recent_tokens = keep_recent_tokens
+        self.options = {"num_predict": summary_max_tokens}
+        self._job = None
+        self._prefix = None
+        self._messages = None
+        # Summary request that last failed, and when it may be tried again
+        self._failed_messages = None
+        self._failures = 0
+        self._retry_at = 0.0
+        self.compactions = 0
+        self.failures = 0
+
+    @property
+    def running(self):
+        return self._job is not None
+
+    def maybe_start(self, engine):
+        """
+        Start a compaction if the history is over the threshold.
+
+        Args:
+            engine: AIEngine used to run the summarization request
+        """
+        if self._job is not None:
+            return
+        candidate = self.conversation.compaction_candidate(
+            self.threshold_tokens, self.keep_recent_tokens
+        )
+        if candidate is None:
+            return
+        previous_summary, prefix = candidate
+        messages = build_summary_messages(previous_summary, prefix)
+        if messages == self._failed_messages and time.monotonic() < self._retry_at:
+            return
+
+        cached = get_cached_response(messages, self.model_name, self.options)
+        if cached is not None:
+            self._apply(messages, prefix, cached)
+            return
+        self._prefix = prefix
+        self._messages = messages
+        self._job = engine.submit(messages, self.model_name, self.options)
+
+    def cancel(self):
+        """Abandon a running compaction (e.g. because a live request starts)."""
+        if self._job is not None:
+            self._job.cancel()
+            self._job = None
+            self._prefix = None
+            self._messages = None
+
+    def handle_result(self, job_id, status, result):
+        """
+        Consume an engine result if it belongs to the compaction job.
+
+        Returns:
+            True if the result was the compactor's, False otherwise.
+        """
+        if self._job is None or job_id != self._job.id:
+            return False
+        if status == "partial":
+            return True
+        if status == "success":
+            self._apply(self._messages, self._prefix, result)
+        elif status == "error":
+            self._record_failure(self._messages)
+        self._job = None
+        self._prefix = None
+        self._messages = None
+        return True
+
+    def _apply(self, messages, prefix, summary):
+        if summary == CONNECTION_ERROR_REPLY or not summary or not summary.strip():
+            self._record_failure(messages)
+            return
+        if self.conversation.apply_summary(prefix, summary):
+            self.compactions += 1
+            self._failed_messages = None
+            self._failures = 0
+            print(f"Compacted {len(prefix)} turns into a summary "
+                  f"({self.conversation.token_count()} tokens left)", file=sys.stderr)
+        else:
+            # A changed history yields other messages, so this only holds
+            # back a retry of the exact same request
+            self._record_failure(messages)
+
+    def _record_failure(self, messages):
+        """Keep messages from being resubmitted until the backoff expires."""
+        if messages != self._failed_messages:
+            self._failed_messages = messages
+            self._failures = 0
+        delay = min(COMPACT_RETRY_MAX_DELAY, COMPACT_RETRY_DELAY * (2 ** min(self._failures, 16)))
+        self._failures += 1
+        self.failures += 1
+        self._retry_at = time.monotonic() + delay
+
+
+class PromptPrefiller:
+    """Warms the server's prompt cache with the conversation while the user types.
+
+    Ollama keeps the evaluated prompt of the last request and reuses its
+    longest common prefix, so sending the stable part of the next request
+    (system prompt and history) ahead of time leaves only the new message
+    to process once it is submitted. Each history prefix is prefilled at
+    most once; a prefill for an outdated prefix or model is cancelled.
+    """
+
+    def __init__(self, conversation, session=None, num_predict=PREFILL_NUM_PREDICT):
+        """
+        Args:
+            conversation: Conversation whose history is prefilled
+            session: Optional ContextSession when replies go through generate
+            num_predict: Tokens generated by a prefill request
+        """
+        self.conversation = conversation
+        self.session = session
+        self.options = {"num_predict": num_predict}
+        self._job = None
+        self._key = None         # prefix of the running prefill
+        self._ready_key = None   # prefix the server holds after the last prefill
+        self._ready_seconds = 0.0
+
+        # Counters
+        self.started = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.hits = 0
+        self.saved_seconds = 0.0
+
+    @property
+    def running(self):
+        return self._job is not None
+
+    def _prefix_key(self, model_name, pending_turns=0):
+        revision, _, turns = self.conversation.snapshot()
+        return revision, len(turns) - pending_turns, model_name
+
+    def maybe_start(self, engine, model_name):
+        """
+        Prefill the current history for model_name unless that was done already.
+
+        Args:
+            engine: AIEngine used to run the prefill request
+            model_name: Model the next request is expected to use
+        """
+        key = self._prefix_key(model_name)
+        if key == self._ready_key or key == self._key:
+            return
+        self.cancel()
+
+        if self.session is not None:
+            plan = self.session.prefix_request(self.conversation, model_name)
+            if plan is None:
+                return
+            self._job = engine.prefill(model_name, plan=plan, options=self.options)
+        else:
+            self._job = engine.prefill(model_name, messages=self.conversation.messages(),
+                                       options=self.options)
+        self._key = key
+        self.started += 1
+
+    def cancel(self):
+        """Abandon a running prefill (its prefix or model went stale)."""
+        if self._job is not None:
+            self._job.cancel()
+            self._job = None
+            self._key = None
+            self.cancelled += 1
+
+    def handle_result(self, job_id, status, result):
+        """
+        Consume an engine result if it belongs to the prefill job.
+
+        Returns:
+            True if the result was the prefiller's, False otherwise.
+        """
+        if self._job is None or job_id != self._job.id:
+            return False
+        if status == "prefill" and result is not None:
+            self._ready_key = self._key
+            self._ready_seconds = result
+            self.completed += 1
+        self._job = None
+        self._key = None
+        return True
+
+    def claim(self, model_name):
+        """
+        Account for a real request that was just started.
+
+        Call after the new user message has been added to the conversation.
+
+        Returns:
+            Seconds of prompt processing the prefill took off this request.
+        """
+        key = self._prefix_key(model_name, pending_turns=1)
+        if self._key is not None and self._key != key:
+            self.cancel()
+        saved = 0.0
+        if key == self._ready_key:
+            saved = self._ready_seconds
+            self.hits += 1
+            self.saved_seconds += saved
+        # The server now holds the new request instead
+        self._ready_key = None
+        return saved
+
+    def stats(self):
+        """Return the prefill counters as a dict."""
+        return {
+            "started": self.started,
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "hits": self.hits,
+            "saved_seconds": self.saved_seconds,
+        }
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def create_client(host=None, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                  max_connections=MAX_CONNECTIONS):
+    """
+    Create an Ollama client with keep-alive connection pooling and timeouts.
+
+    Args:
+        host: Server URL, e.g. "http://127.0.0.1:11434" (default OLLAMA_HOST)
+        connect_timeout: Seconds allowed to establish a connection
+        read_timeout: Seconds allowed between bytes of a response
+        max_connections: Size of the connection pool (caps concurrent requests)
+    """
+    return ollama.Client(
+        host=host or OLLAMA_HOST,
+        timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+        ),
+    )
+
+
+def create_async_client(host=None, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                        max_connections=MAX_CONNECTIONS):
+    """Create an ollama.AsyncClient with the same pooling and timeouts as create_client()."""
+    return ollama.AsyncClient(
+        host=host or OLLAMA_HOST,
+        timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+        ),
+    )
+
+
+def get_client():
+    """Return the shared Ollama client, creating it on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = create_client()
+        return _client
+
+
+def set_client(client):
+    """
+    Replace the shared Ollama client (e.g. to point at a local stand-in server).
+
+    Args:
+        client: An ollama.Client, or None to recreate the default on next use
+
+    Returns:
+        The previously installed client (or None).
+    """
+    global _client
+    with _client_lock:
+        previous = _client
+        _client = client
+        return previous
+
+
+def configure_client(host=None, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT):
+    """Install a new shared client built from the given settings."""
+    set_client(create_client(host, connect_timeout, read_timeout))
+
+
+def check_health(timeout: float = HEALTH_CHECK_TIMEOUT) -> bool:
+    """
+    Probe the Ollama server without touching any model.
+
+    Returns:
+        True if the server answered the version endpoint within timeout.
+    """
+    client = get_client()
+    try:
+        # The underlying httpx client shares the pooled keep-alive connections
+        response = client._client.get("/api/version", timeout=timeout)
+        response.raise_for_status()
+    except Exception:
+        return False
+    return True
+
+
+class BackendUnavailable(ConnectionError):
+    """Raised instead of contacting the server while it is marked down."""
+
+
+# Shared by every request path (CLI, batch, UI engine)
+backend_breaker = CircuitBreaker(
+    failure_threshold=BREAKER_FAILURE_THRESHOLD,
+    probe=lambda: check_health(),
+    probe_interval=BREAKER_PROBE_INTERVAL,
+    probe_max_interval=BREAKER_PROBE_MAX_INTERVAL,
+    name="Ollama server",
+)
+
+
+def is_transient_error(exc) -> bool:
+    """True for failures worth retrying: connection errors and 5xx replies."""
+    if isinstance(exc, BackendUnavailable):
+        return False
+    if isinstance(exc, (ConnectionError, httpx.ConnectError, httpx.ConnectTimeout)):
+        return True
+    return isinstance(exc, ollama.ResponseError) and exc.status_code >= 500
+
+
+def is_backend_failure(exc) -> bool:
+    """
+    True for failures that count against the server's circuit breaker.
+
+    These are the transient errors plus read timeouts and broken
+    connections. Those are not retried: a request that already waited
+    READ_TIMEOUT for an answer would only wait that long again.
+    """
+    if is_transient_error(exc):
+        return True
+    return not isinstance(exc, BackendUnavailable) and isinstance(
+        exc, (TimeoutError, httpx.TransportError))
+
+
+def call_with_retry(fn, attempts: int = RETRY_ATTEMPTS, breaker: CircuitBreaker = None):
+    """
+    Call fn(), retrying transient failures with backoff and jitter.
+
+    Raises:
+        BackendUnavailable: Without calling fn while the server is marked down.
+        Exception: The last error of fn once the attempts are used up, or
+            immediately for errors that are not transient.
+    """
+    breaker = breaker or backend_breaker
+    for attempt in range(attempts):
+        if not breaker.allow():
+            raise BackendUnavailable("the model server is unreachable")
+        try:
+            result = fn()
+        except Exception as exc:
+            if not is_backend_failure(exc):
+                breaker.record_success()  # the server did answer
+                raise
+            breaker.record_failure()
+            if not is_transient_error(exc) or attempt + 1 >= attempts or breaker.is_open:
+                raise
+            time.sleep(backoff_delay(attempt, RETRY_BASE_DELAY, RETRY_MAX_DELAY))
+        else:
+            breaker.record_success()
+            return result
+
+
+def open_chat_stream(client, **kwargs):
+    """
+    Start a streamed chat, retrying until its first chunk arrives.
+
+    Only the start of a stream is retried; once chunks have been delivered
+    a failure propagates to the caller.
+
+    Returns:
+        Iterator over all chunks of the stream.
+    """
+    def start():
+        stream = iter(client.chat(stream=True, **kwargs))
+        return stream, next(stream, None)
+
+    stream, first = call_with_retry(start)
+    return itertools.chain([first] if first is not None else [], stream)
+
+
+def get_cached_response(messages: list, model_name: str = "llama3.2", options: dict = None):
+    """
+    Look up a previous reply to exactly this request.
+
+    Returns:
+        The cached reply string, or None if the request has not been seen.
+    """
+    if not messages:
+        return None
+    return response_cache.get(ResponseCache.make_key(model_name, messages, options))
+
+
+def store_cached_response(messages: list, reply: str, model_name: str = "llama3.2",
+                          options: dict = None) -> None:
+    """Remember a successful reply so identical requests can skip inference."""
+    if not messages or not reply or reply == CONNECTION_ERROR_REPLY:
+        return
+    response_cache.put(ResponseCache.make_key(model_name, messages, options), reply)
+
+
+def record_load_duration(model_name: str, response) -> float:
+    """
+    Remember the load_duration reported in a final Ollama response.
+
+    Returns:
+        The load time in seconds (0.0 when the model was already resident).
+    """
+    seconds = (response.get("load_duration") or 0) / 1e9
+    last_load_durations[model_name] = seconds
+    if seconds >= COLD_LOAD_THRESHOLD:
+        print(f"Cold load of {model_name}: {seconds:.2f} s", file=sys.stderr)
+    return seconds
+
+
+def warmup_model(model_name: str = "llama3.2", keep_alive=KEEP_ALIVE):
+    """
+    Load the model into memory ahead of the first real request.
+
+    An empty generate request makes Ollama load the model and keep it
+    resident for keep_alive without producing any tokens.
+
+    Returns:
+        The load time in seconds, or None if the server could not be reached.
+    """
+    try:
+        response = call_with_retry(
+            lambda: get_client().generate(model=model_name, prompt="", keep_alive=keep_alive)
+        )
+    except Exception as exc:
+        report_model_error(exc)
+        return None
+    return record_load_duration(model_name, response)
+
+
+def open_memory(directory=MEMORY_DIR):
+    """Open (or create) the long-term vector memory."""
+    return VectorMemory(directory)
+
+
+def embed_texts(texts: list, model_name: str = EMBED_MODEL) -> list:
+    """
+    Embed texts with the Ollama embeddings endpoint.
+
+    Returns:
+        One vector (list of floats) per input text.
+    """
+    response = call_with_retry(
+        lambda: get_client().embed(model=model_name, input=texts, keep_alive=KEEP_ALIVE)
+    )
+    return response["embeddings"]
+
+
+def format_exchange(user_text: str, reply: str) -> str:
+    """Text stored in memory for one question/answer pair."""
+    return f"User: {user_text}\nAssistant: {reply}"
+
+
+def recall(memory, messages: list, k: int = MEMORY_TOP_K, min_score: float = MEMORY_MIN_SCORE) -> list:
+    """
+    Add the memories most relevant to the last message to a message list.
+
+    Returns:
+        A new message list (the original one if nothing relevant was found
+        or the embedding model is unavailable).
+    """
+    if memory is None or not len(memory) or not messages:
+        return messages
+    try:
+        vector = embed_texts([messages[-1]["content"]])[0]
+    except Exception as exc:
+        print(f"Memory lookup skipped: {exc}", file=sys.stderr)
+        return messages
+    return inject_memories(messages, memory.search(vector, k, min_score))
+
+
+def remember(memory, user_text: str, reply: str) -> None:
+    """Store a question/answer pair in long-term memory."""
+    if memory is None or not reply or reply == CONNECTION_ERROR_REPLY:
+        return
+    text = format_exchange(user_text, reply)
+    try:
+        memory.add(embed_texts([text])[0], text)
+    except Exception as exc:
+        print(f"Could not store memory: {exc}", file=sys.stderr)
+
+
+def report_model_error(exc) -> None:
+    """Print a model failure together with the usual setup hint."""
+    if isinstance(exc, BackendUnavailable):
+        return  # the breaker already reported the outage
+    print("Failed to run the model.", file=sys.stderr)
+    print("Make sure Ollama is installed and the model is downloaded.", file=sys.stderr)
+    print(f"Error: {exc}", file=sys.stderr)
+
+
+def _chat_stream(messages: list, model_name: str, options: dict = None, record: dict = None):
+    """
+    Yield non-empty content chunks from a streamed chat; errors propagate.
+
+    The server's timing fields are added to record, if given, at the end.
+    """
+    stream = open_chat_stream(get_client(), model=model_name, messages=messages,
+                              options=options, keep_alive=KEEP_ALIVE)
+    for chunk in stream:
+        if chunk.get("done"):
+            record_load_duration(model_name, chunk)
+            if record is not None:
+                record.update(server_metrics(chunk))
+        content = chunk["message"]["content"]
+        if content:
+            yield content
+
+
+def stream_model_response(messages: list, model_name: str = "llama3.2", options: dict = None):
+    """
+    Stream the assistant's reply from the Ollama model chunk by chunk.
+
+    Args:
+        messages: List of message dicts, e.g. [{"role": "user", "content": "Hello"}]
+        model_name: Name of the Ollama model to use (default "llama3.2")
+        options: Optional Ollama generation options (temperature, num_predict, ...)
+
+    Yields:
+        Pieces of the assistant's reply as soon as the model produces them.
+        If an error occurs before anything was produced, yields a single
+        user-friendly error message instead.
+    """
+    if not messages:
+        # No input to send
+        return
+
+    record = {"source": "stream", "model": model_name, "cached": False, "status": "cancelled"}
+    started = time.perf_counter()
+    produced_any = False
+    try:
+        for content in _chat_stream(messages, model_name, options, record):
+            if not produced_any:
+                record["ttft"] = time.perf_counter() - started
+            produced_any = True
+            yield content
+        record["status"] = "success"
+    except Exception as exc:
+        record["status"] = "error"
+        report_model_error(exc)
+        if not produced_any:
+            yield CONNECTION_ERROR_REPLY
+    finally:
+        # Also runs when the caller stops reading early
+        record["total"] = time.perf_counter() - started
+        request_metrics.add(record)
+
+
+def get_model_response(messages: list, model_name: str = "llama3.2", on_chunk=None,
+                       options: dict = None, use_cache: bool = True) -> str:
     """
     Send a list of messages to the Ollama model and return the assistant's reply.
 
     Args:
         messages: List of message dicts, e.g. [{"role": "user", "content": "Hello"}]
         model_name: Name of the Ollama model to use (default "llama3.2")
+        on_chunk: Optional callback. When given, the reply is streamed and the
+            callback is called with the accumulated text after every chunk.
+        options: Optional Ollama generation options (temperature, num_predict, ...)
+        use_cache: Serve and remember complete replies from the response cache
 
     Returns:
         The content of the assistant's reply as a string.
@@ -25,17 +978,56 @@ def get_model_response(messages: list, model_name: str = "llama3.2") -> str:
         # No input to send
         return ""
 
-    try:
-        response = ollama.chat(model=model_name, messages=messages)
-    except Exception as exc:
-        print("Failed to run the model.")
-        print("Make sure Ollama is installed and the model is downloaded.")
-        print(f"Error: {exc}")
-        # In a GUI app, you might want to return a user‑friendly error message
-        return "I'm having trouble connecting to my brain right now."
+    record = {"source": "sync", "model": model_name, "cached": False}
+    started = time.perf_counter()
+
+    if use_cache:
+        cached = get_cached_response(messages, model_name, options)
+        if cached is not None:
+            record.update(status="success", cached=True, total=time.perf_counter() - started)
+            request_metrics.add(record)
+            if on_chunk is not None:
+                on_chunk(cached)
+            return cached
+
+    if on_chunk is not None:
+        reply = ""
+        try:
+            for piece in _chat_stream(messages, model_name, options, record):
+                if not reply:
+                    record["ttft"] = time.perf_counter() - started
+                reply += piece
+                on_chunk(reply)
+        except Exception as exc:
+            report_model_error(exc)
+            record.update(status="error", total=time.perf_counter() - started)
+            request_metrics.add(record)
+            if not reply:
+                reply = CONNECTION_ERROR_REPLY
+                on_chunk(reply)
+            # Interrupted replies are never cached
+            return reply
+    else:
+        try:
+            response = call_with_retry(lambda: get_client().chat(
+                model=model_name, messages=messages, options=options, keep_alive=KEEP_ALIVE
+            ))
+        except Exception as exc:
+            report_model_error(exc)
+            record.update(status="error", total=time.perf_counter() - started)
+            request_metrics.add(record)
+            # In a GUI app, you might want to return a user‑friendly error message
+            return CONNECTION_ERROR_REPLY
+        record_load_duration(model_name, response)
+        record.update(server_metrics(response))
+        # Return only the assistant's content
+        reply = response["message"]["content"]
 
-    # Return only the assistant's content
-    return response["message"]["content"]
+    record.update(status="success", total=time.perf_counter() - started)
+    request_metrics.add(record)
+    if use_cache:
+        store_cached_response(messages, reply, model_name, options)
+    return reply
 
 
 def chat_with_llama(model_name: str = "llama3.2") -> None:
@@ -43,9 +1035,12 @@ def chat_with_llama(model_name: str = "llama3.2") -> None:
     Start an interactive chat session with a specified Ollama model.
     Type 'exit' or 'quit' to end the conversation.
     """
-    messages = []  # holds the entire conversation history
+    conversation = Conversation()  # token-budgeted conversation history
+    memory = open_memory()  # facts remembered from earlier sessions
 
     print(f"Starting a chat with {model_name}. Type 'exit' to quit.\n")
+    # Load the model in the background while the user types the first message
+    threading.Thread(target=warmup_model, args=(model_name,), daemon=True).start()
 
     while True:
         user_input = input("You: ")
@@ -53,22 +1048,255 @@ def chat_with_llama(model_name: str = "llama3.2") -> None:
             print("Goodbye!")
             break
 
-        messages.append({"role": "user", "content": user_input})
+        conversation.add_user(user_input)
 
         try:
-            response = ollama.chat(model=model_name, messages=messages)
+            messages = recall(memory, conversation.messages())
+            print("Assistant: ", end="", flush=True)
+            assistant_reply = ""
+            for content in _chat_stream(messages, model_name):
+                assistant_reply += content
+                print(content, end="", flush=True)
+            print("\n")
         except Exception as exc:
-            print("Failed to run the model.")
-            print("Make sure Ollama is installed and the model is downloaded.")
-            print(f"Error: {exc}")
+            report_model_error(exc)
             sys.exit(1)
 
-        assistant_reply = response["message"]["content"]
-        print(f"Assistant: {assistant_reply}\n")
+        conversation.add_assistant(assistant_reply)
+        remember(memory, user_input, assistant_reply)
+
+
+# ---------------------------------------------------------------------------
+# Batch mode
+# ---------------------------------------------------------------------------
+def read_batch_items(lines):
+    """
+    Parse JSONL prompt lines into batch items.
+
+    Each line is a JSON object with either "prompt" (plus an optional
+    "system") or a full "messages" list, and optionally "id", "model" and
+    "options". A bare JSON string is taken as the prompt. Items without an
+    "id" are identified by their line number.
+
+    Yields:
+        Dicts with "id", "messages", "model" and "options".
+    """
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError:
+            print(f"Skipping line {number}: not valid JSON", file=sys.stderr)
+            continue
+        if isinstance(data, str):
+            data = {"prompt": data}
+        if not isinstance(data, dict) or not ("messages" in data or "prompt" in data):
+            print(f"Skipping line {number}: expected a \"prompt\" or \"messages\"", file=sys.stderr)
+            continue
+
+        if "messages" in data:
+            messages = data["messages"]
+        else:
+            messages = [{"role": "user", "content": str(data["prompt"])}]
+            if data.get("system"):
+                messages.insert(0, {"role": "system", "content": data["system"]})
+        yield {
+            "id": data.get("id", number),
+            "messages": messages,
+            "model": data.get("model"),
+            "options": data.get("options"),
+        }
+
+
+def completed_batch_ids(output_path):
+    """Return the ids that already have a successful result in output_path."""
+    done = set()
+    if not output_path or not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # a line cut short by an interruption
+            if isinstance(record, dict) and record.get("status") == "ok":
+                done.add(json.dumps(record.get("id")))
+    return done
+
+
+def run_batch_item(client, item, model_name="llama3.2", options=None, use_cache=False):
+    """
+    Answer one batch item with a streamed request.
+
+    Returns:
+        Result dict with the reply, its status and the timing and token
+        counts reported by the server.
+    """
+    model_name = item.get("model") or model_name
+    options = item.get("options") or options
+    record = {"id": item["id"], "model": model_name}
+    started = time.perf_counter()
+
+    reply = get_cached_response(item["messages"], model_name, options) if use_cache else None
+    if reply is not None:
+        record.update(status="ok", reply=reply, cached=True,
+                      latency=round(time.perf_counter() - started, 4))
+        return record
+
+    reply = ""
+    ttft = None
+    final = {}
+    try:
+        stream = open_chat_stream(client, model=model_name, messages=item["messages"],
+                                  options=options, keep_alive=KEEP_ALIVE)
+        for chunk in stream:
+            content = chunk["message"]["content"]
+            if content and ttft is None:
+                ttft = time.perf_counter() - started
+            reply += content
+            if chunk.get("done"):
+                final = chunk
+    except Exception as exc:
+        record.update(status="error", error=str(exc), reply=reply,
+                      latency=round(time.perf_counter() - started, 4))
+        return record
+
+    latency = time.perf_counter() - started
+    eval_count = final.get("eval_count") or 0
+    eval_seconds = (final.get("eval_duration") or 0) / 1e9
+    if use_cache:
+        store_cached_response(item["messages"], reply, model_name, options)
+    record.update(
+        status="ok",
+        reply=reply,
+        latency=round(latency, 4),
+        ttft=None if ttft is None else round(ttft, 4),
+        prompt_tokens=final.get("prompt_eval_count") or 0,
+        completion_tokens=eval_count,
+        tokens_per_second=round(eval_count / eval_seconds, 2) if eval_seconds else None,
+    )
+    return record
+
+
+def run_batch(input_path, output_path, model_name="llama3.2", concurrency=4, options=None,
+              use_cache=False, resume=True, host=None):
+    """
+    Answer every prompt of a JSONL file and write the results as JSONL.
+
+    Results are appended to output_path as soon as each one finishes, in
+    completion order. With resume, items that already have a successful
+    result in output_path are skipped, so an interrupted run can simply be
+    started again.
+
+    Args:
+        input_path: JSONL prompt file, or "-" to read standard input
+        output_path: JSONL result file, or "-" to write standard output
+        model_name: Model for items that do not name one
+        concurrency: Maximum number of requests in flight
+        options: Generation options for items that do not set any
+        use_cache: Serve and store replies through the response cache
+        resume: Skip items already answered in output_path
+        host: Ollama server URL (default OLLAMA_HOST)
+
+    Returns:
+        Dict with "completed", "failed", "skipped", "seconds" and "throughput".
+    """
+    to_stdout = output_path == "-"
+    done = completed_batch_ids(output_path) if resume and not to_stdout else set()
+    client = create_client(host=host, max_connections=max(concurrency, 1))
+    source = sys.stdin if input_path == "-" else open(input_path, "r", encoding="utf-8")
+    if to_stdout:
+        out = sys.stdout
+    else:
+        out = open(output_path, "a", encoding="utf-8")
+        # An interrupted run may have left half a line behind
+        if out.tell() > 0:
+            with open(output_path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    out.write("\n")
+
+    stats = {"completed": 0, "failed": 0, "skipped": 0}
+    latencies = []
+
+    def write(future):
+        record = future.result()
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        out.flush()
+        if record["status"] == "ok":
+            stats["completed"] += 1
+            latencies.append(record["latency"])
+        else:
+            stats["failed"] += 1
+            print(f"Item {record['id']} failed: {record['error']}", file=sys.stderr)
+
+    started = time.perf_counter()
+    pool = ThreadPoolExecutor(max_workers=concurrency)
+    pending = set()
+    try:
+        for item in read_batch_items(source):
+            if json.dumps(item["id"]) in done:
+                stats["skipped"] += 1
+                continue
+            # Keep the queue short so huge input files are read lazily
+            while len(pending) >= concurrency * 2:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    write(future)
+            pending.add(pool.submit(run_batch_item, client, item, model_name, options, use_cache))
+        while pending:
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                write(future)
+    except KeyboardInterrupt:
+        print("Interrupted; run again with the same output file to resume.", file=sys.stderr)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+        if source is not sys.stdin:
+            source.close()
+        if not to_stdout:
+            out.close()
+
+    seconds = time.perf_counter() - started
+    latencies.sort()
+    stats.update(
+        seconds=round(seconds, 3),
+        throughput=round(stats["completed"] / seconds, 3) if seconds else 0.0,
+        p50_latency=latencies[len(latencies) // 2] if latencies else None,
+    )
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chat with a local Ollama model.")
+    parser.add_argument("--model", default="llama3.2")
+    parser.add_argument("--host", help="Ollama server URL (default $OLLAMA_HOST)")
+    parser.add_argument("--batch", metavar="PROMPTS",
+                        help="answer the prompts of a JSONL file (\"-\" for stdin) and exit")
+    parser.add_argument("--output", default="-",
+                        help="JSONL result file for --batch (default stdout)")
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="requests in flight in --batch mode")
+    parser.add_argument("--no-resume", action="store_true",
+                        help="answer every prompt even if the output file has a result for it")
+    parser.add_argument("--use-cache", action="store_true",
+                        help="serve repeated prompts from the response cache")
+    args = parser.parse_args()
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
 
-        messages.append({"role": "assistant", "content": assistant_reply})
+    if not args.batch:
+        if args.host:
+            configure_client(args.host)
+        chat_with_llama(args.model)
+        return
+    stats = run_batch(args.batch, args.output, args.model, args.concurrency,
+                      use_cache=args.use_cache, resume=not args.no_resume, host=args.host)
+    print(f"Batch finished: {json.dumps(stats)}", file=sys.stderr)
 
 
 if __name__ == "__main__":
-    # If the script is run directly, start the interactive chat
-    chat_with_llama()
\ No newline at end of file
+    # Interactive chat by default; --batch answers a prompt file
+    main()
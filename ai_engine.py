@@ -0,0 +1,398 @@
+import asyncio
+import itertools
+import queue
+import threading
+import time
+
+import ai_core
+from circuit_breaker import backoff_delay
+from metrics import server_metrics
+from vector_memory import format_memories, inject_memories
+
+
+class AIJob:
+    """Handle for one request submitted to the AIEngine."""
+
+    def __init__(self, engine, job_id, messages, model_name, options, use_memory=False,
+                 session=None, plan=None):
+        self._engine = engine
+        self.id = job_id
+        self.messages = messages
+        self.model_name = model_name
+        self.options = options
+        self.use_memory = use_memory
+        self.session = session  # ai_core.ContextSession for generate-based jobs
+        self.plan = plan        # request built by session.plan()
+        self.submitted_at = time.perf_counter()
+        self.queue_wait = 0.0  # time spent queued before submit()
+        # Timing record added to ai_core.request_metrics when the job ends
+        self.metrics = {"id": job_id, "source": "engine", "model": model_name, "cached": False}
+        self.future = None  # concurrent.futures.Future of the running coroutine
+        self.started = False
+        self.cancel_reported = False  # set under AIEngine._cancel_lock
+
+    def cancel(self):
+        """Cancel the job; an in-flight HTTP stream is closed."""
+        self._engine.cancel(self)
+
+    def done(self):
+        return self.future is not None and self.future.done()
+
+
+class AIEngine:
+    """Runs model requests on a single background asyncio event loop.
+
+    Jobs are submitted from any thread and run concurrently on the loop with
+    ollama.AsyncClient. Results are delivered as (job_id, status, payload)
+    tuples on a thread-safe queue, where status is one of:
+        "partial"   - accumulated reply text so far (throttled)
+        "success"   - the full reply
+        "error"     - a user-facing error message
+        "cancelled" - the job was cancelled; payload is the text received so far
+        "warmup"    - a warmup finished; payload is the load time in seconds
+                      (None if the server could not be reached)
+        "prefill"   - a prefill finished; payload is the prompt processing
+                      time in seconds (None if it failed)
+    """
+
+    def __init__(self, result_queue=None, stream_push_fps=30, memory=None, notify=None):
+        """
+        Args:
+            result_queue: queue.Queue to deliver results on (created if None)
+            stream_push_fps: Maximum number of "partial" results per second per job
+            memory: Optional VectorMemory used by jobs submitted with use_memory
+            notify: Optional callable run (from any thread) after every result,
+                e.g. to wake up an event loop that is waiting for input
+        """
+        self.memory = memory
+        self.notify = notify
+        self.results = result_queue if result_queue is not None else queue.Queue()
+        self.stream_push_interval = 1.0 / stream_push_fps if stream_push_fps else 0.0
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name="ai-engine", daemon=True)
+        self._client = None
+        self._job_ids = itertools.count(1)
+        self._started = False
+        # cancel() and the cancelled coroutine may both try to report a job
+        self._cancel_lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+    def start(self):
+        """Start the background event loop thread."""
+        if not self._started:
+            self._started = True
+            self._thread.start()
+
+    def stop(self, timeout=2.0):
+        """Cancel all running jobs and stop the event loop."""
+        if not self._started:
+            return
+
+        async def shutdown():
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._loop.stop()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self._loop)
+        self._thread.join(timeout)
+        self._started = False
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def set_client(self, client):
+        """Use a specific ollama.AsyncClient (None recreates the default on next use)."""
+        self._client = client
+
+    def _get_client(self):
+        # Created lazily so it is bound to the engine's own event loop
+        if self._client is None:
+            self._client = ai_core.create_async_client()
+        return self._client
+
+    # ------------------------------------------------------------------
+    # Job API (thread-safe)
+    # ------------------------------------------------------------------
+    def submit(self, messages, model_name="llama3.2", options=None, use_memory=False,
+               session=None, plan=None, queue_wait=0.0):
+        """
+        Queue a chat request on the event loop.
+
+        Args:
+            messages: Message list to send to the model
+            model_name: Name of the Ollama model to use
+            options: Optional Ollama generation options
+            use_memory: Add relevant long-term memories to the prompt and
+                remember the exchange afterwards
+            session: Optional ai_core.ContextSession; when given together with
+                plan (from session.plan()), the request goes through the
+                generate endpoint and reuses the model's KV context
+            plan: Request built by session.plan() for this turn
+            queue_wait: Seconds the request already waited before being
+                submitted, added to its metrics record
+
+        Returns:
+            AIJob handle whose results arrive on self.results.
+        """
+        self.start()
+        job = AIJob(self, next(self._job_ids), messages, model_name, options, use_memory,
+                    session, plan)
+        job.queue_wait = queue_wait
+        job.future = asyncio.run_coroutine_threadsafe(self._run_chat(job), self._loop)
+        return job
+
+    def warmup(self, model_name="llama3.2", keep_alive=ai_core.KEEP_ALIVE):
+        """
+        Load the model in the background so the first real request is fast.
+
+        Returns:
+            AIJob handle; a "warmup" result is delivered when it finishes.
+        """
+        self.start()
+        job = AIJob(self, next(self._job_ids), None, model_name, None)
+        job.future = asyncio.run_coroutine_threadsafe(self._run_warmup(job, keep_alive), self._loop)
+        return job
+
+    def prefill(self, model_name, messages=None, plan=None, options=None):
+        """
+        Evaluate a prompt prefix so the server caches it for the next request.
+
+        Args:
+            model_name: Name of the Ollama model to use
+            messages: Chat messages to prefill, or
+            plan: Generate request ("prompt", "system", "context") to prefill
+            options: Generation options; should limit num_predict
+
+        Returns:
+            AIJob handle; a "prefill" result is delivered when it finishes.
+        """
+        self.start()
+        job = AIJob(self, next(self._job_ids), messages, model_name, options, plan=plan)
+        job.future = asyncio.run_coroutine_threadsafe(self._run_prefill(job), self._loop)
+        return job
+
+    def submit_result(self, reply):
+        """
+        Deliver an already known reply (e.g. from the response cache).
+
+        Returns:
+            A finished AIJob whose "success" result is already on self.results.
+        """
+        job = AIJob(self, next(self._job_ids), None, None, None)
+        job.started = True
+        job.metrics["cached"] = True
+        self._finish_metrics(job, "success")
+        self._deliver((job.id, "success", reply))
+        return job
+
+    def cancel(self, job):
+        """Cancel a previously submitted job."""
+        if job is None or job.future is None:
+            return
+        if job.future.cancel() and not job.started:
+            # The coroutine may never run, so it may not report the cancellation
+            # itself; if it did start meanwhile, only the first report counts
+            self._report_cancelled(job, "", finish_metrics=job.messages is not None)
+
+    def _report_cancelled(self, job, reply, finish_metrics=True):
+        """Deliver the "cancelled" result of job unless it was already delivered."""
+        with self._cancel_lock:
+            if job.cancel_reported:
+                return
+            job.cancel_reported = True
+        if finish_metrics:
+            self._finish_metrics(job, "cancelled")
+        self._deliver((job.id, "cancelled", reply))
+
+    def _deliver(self, result):
+        self.results.put(result)
+        if self.notify is not None:
+            self.notify()
+
+    def _finish_metrics(self, job, status):
+        now = time.perf_counter()
+        job.metrics.update(status=status, total=now - job.submitted_at, finished_at=now)
+        ai_core.request_metrics.add(job.metrics)
+
+    # ------------------------------------------------------------------
+    # Coroutines (run on the engine loop)
+    # ------------------------------------------------------------------
+    async def _call_with_retry(self, factory, attempts=ai_core.RETRY_ATTEMPTS):
+        """Async counterpart of ai_core.call_with_retry; factory returns an awaitable."""
+        breaker = ai_core.backend_breaker
+        for attempt in range(attempts):
+            if not breaker.allow():
+                raise ai_core.BackendUnavailable("the model server is unreachable")
+            try:
+                result = await factory()
+            except Exception as exc:
+                if not ai_core.is_backend_failure(exc):
+                    breaker.record_success()  # the server did answer
+                    raise
+                breaker.record_failure()
+                if (not ai_core.is_transient_error(exc) or attempt + 1 >= attempts
+                        or breaker.is_open):
+                    raise
+                await asyncio.sleep(backoff_delay(attempt, ai_core.RETRY_BASE_DELAY,
+                                                  ai_core.RETRY_MAX_DELAY))
+            else:
+                breaker.record_success()
+                return result
+
+    async def _start_stream(self, request):
+        """Yield the chunks of a streamed call, retrying until its first chunk arrives."""
+        async def start():
+            stream = await request()
+            return stream, await anext(stream, None)
+
+        stream, first = await self._call_with_retry(start)
+        if first is None:
+            return
+        yield first
+        async for chunk in stream:
+            yield chunk
+
+    async def _embed(self, text):
+        response = await self._call_with_retry(lambda: self._get_client().embed(
+            model=ai_core.EMBED_MODEL, input=[text], keep_alive=ai_core.KEEP_ALIVE
+        ))
+        return response["embeddings"][0]
+
+    async def _recall(self, query):
+        """Return the memories most relevant to query as (score, text) tuples."""
+        if self.memory is None or not len(self.memory):
+            return []
+        try:
+            vector = await self._embed(query)
+        except Exception as exc:
+            print(f"Memory lookup skipped: {exc}")
+            return []
+        # A search scans every stored vector; keep it off the event loop so
+        # the other streams are not held up
+        return await self._loop.run_in_executor(
+            None, self.memory.search, vector, ai_core.MEMORY_TOP_K, ai_core.MEMORY_MIN_SCORE
+        )
+
+    async def _remember(self, user_text, reply):
+        text = ai_core.format_exchange(user_text, reply)
+        try:
+            vector = await self._embed(text)
+            # File writes happen off the event loop
+            await self._loop.run_in_executor(None, self.memory.add, vector, text)
+        except Exception as exc:
+            print(f"Could not store memory: {exc}")
+
+    async def _open_stream(self, job, hits):
+        """Start the streamed request for job; yields (content, chunk) pairs."""
+        client = self._get_client()
+        if job.plan is None:
+            messages = inject_memories(job.messages, hits)
+            stream = self._start_stream(lambda: client.chat(
+                model=job.model_name, messages=messages,
+                options=job.options, keep_alive=ai_core.KEEP_ALIVE, stream=True
+            ))
+            async for chunk in stream:
+                yield chunk["message"]["content"], chunk
+            return
+
+        prompt = job.plan["prompt"]
+        if hits:
+            prompt = format_memories(hits) + "\n\n" + prompt
+        stream = self._start_stream(lambda: client.generate(
+            model=job.model_name, prompt=prompt, system=job.plan["system"],
+            context=job.plan["context"], options=job.options,
+            keep_alive=ai_core.KEEP_ALIVE, stream=True
+        ))
+        async for chunk in stream:
+            yield chunk["response"], chunk
+
+    async def _run_chat(self, job):
+        job.started = True
+        job.metrics["queue_wait"] = job.queue_wait + time.perf_counter() - job.submitted_at
+        reply = ""
+        last_push = 0.0
+        context = None
+        try:
+            hits = []
+            if job.use_memory:
+                hits = await self._recall(job.messages[-1]["content"])
+            async for content, chunk in self._open_stream(job, hits):
+                if chunk.get("done"):
+                    ai_core.record_load_duration(job.model_name, chunk)
+                    job.metrics.update(server_metrics(chunk))
+                    context = chunk.get("context")
+                if not content:
+                    continue
+                if not reply:
+                    job.metrics["ttft"] = time.perf_counter() - job.submitted_at
+                reply += content
+                now = time.perf_counter()
+                if now - last_push >= self.stream_push_interval:
+                    last_push = now
+                    self._deliver((job.id, "partial", reply))
+        except asyncio.CancelledError:
+            if job.session is not None:
+                job.session.invalidate()
+            self._report_cancelled(job, reply)
+            raise
+        except Exception as exc:
+            ai_core.report_model_error(exc)
+            if job.session is not None:
+                job.session.invalidate()
+            self._finish_metrics(job, "error")
+            if reply:
+                # Keep what we got, but an interrupted reply is never cached
+                self._deliver((job.id, "success", reply))
+            else:
+                self._deliver((job.id, "error", ai_core.CONNECTION_ERROR_REPLY))
+            return
+
+        if job.session is not None:
+            job.session.commit(job.plan, context)
+        self._finish_metrics(job, "success")
+        self._deliver((job.id, "success", reply))
+        # The cache writes a file and may evict others; keep it off the event loop
+        await self._loop.run_in_executor(
+            None, ai_core.store_cached_response, job.messages, reply, job.model_name, job.options
+        )
+        if job.use_memory and self.memory is not None:
+            await self._remember(job.messages[-1]["content"], reply)
+
+    async def _run_warmup(self, job, keep_alive):
+        job.started = True
+        try:
+            response = await self._call_with_retry(lambda: self._get_client().generate(
+                model=job.model_name, prompt="", keep_alive=keep_alive
+            ))
+        except Exception as exc:
+            ai_core.report_model_error(exc)
+            self._deliver((job.id, "warmup", None))
+            return
+        load_seconds = ai_core.record_load_duration(job.model_name, response)
+        self._deliver((job.id, "warmup", load_seconds))
+
+    async def _run_prefill(self, job):
+        job.started = True
+        final = None
+        try:
+            async for _, chunk in self._open_stream(job, []):
+                if chunk.get("done"):
+                    final = chunk
+        except asyncio.CancelledError:
+            self._report_cancelled(job, "", finish_metrics=False)
+            raise
+        except Exception as exc:
+            ai_core.report_model_error(exc)
+            self._deliver((job.id, "prefill", None))
+            return
+        if final is None:
+            self._deliver((job.id, "prefill", None))
+            return
+        ai_core.record_load_duration(job.model_name, final)
+        self._deliver((job.id, "prefill", (final.get("prompt_eval_duration") or 0) / 1e9))
@@ -0,0 +1,92 @@
+import os
+import time
+
+import pygame
+
+
+ASSET_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class AssetManager:
+    """Loads images once and shares them between everything that draws.
+
+    Images are loaded and converted on first use (so after the display
+    exists), and every scaled variant is kept per (path, scale), so asking
+    for the same image again costs a dict lookup. Callers share the returned
+    surfaces and must not draw on them.
+    """
+
+    def __init__(self, base_dir=ASSET_DIR):
+        """
+        Args:
+            base_dir: Directory relative image paths are resolved against
+        """
+        self.base_dir = base_dir
+        self._surfaces = {}  # (path, scale) -> surface
+        self._load_times = {}  # (path, scale) -> seconds spent loading or scaling
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+
+    def image(self, path, scale=1):
+        """
+        Return the image at path, converted for fast blitting and scaled.
+
+        Args:
+            path: Image path, relative to base_dir unless absolute
+            scale: Size factor; scaling is nearest-neighbour, which keeps
+                pixel art sharp at integer factors
+
+        Returns:
+            The shared pygame surface.
+        """
+        key = (path, scale)
+        surface = self._surfaces.get(key)
+        if surface is not None:
+            self.hits += 1
+            return surface
+
+        self.misses += 1
+        original = self.image(path) if scale != 1 else None
+        start = time.perf_counter()
+        if original is None:
+            surface = pygame.image.load(os.path.join(self.base_dir, path)).convert_alpha()
+        else:
+            size = (int(original.get_width() * scale), int(original.get_height() * scale))
+            surface = pygame.transform.scale(original, size)
+        self._surfaces[key] = surface
+        self._load_times[key] = time.perf_counter() - start
+        return surface
+
+    def clear(self):
+        self._surfaces.clear()
+        self._load_times.clear()
+
+    def stats(self):
+        """
+        Report what has been loaded.
+
+        Returns:
+            Dict with "hits", "misses", "bytes" and "assets", a list with the
+            "path", "scale", "size", "bytes" and "load_ms" of every variant.
+        """
+        assets = []
+        for (path, scale), surface in self._surfaces.items():
+            assets.append({
+                "path": path,
+                "scale": scale,
+                "size": surface.get_size(),
+                "bytes": surface.get_pitch() * surface.get_height(),
+                "load_ms": round(self._load_times[(path, scale)] * 1000, 2),
+            })
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "bytes": sum(asset["bytes"] for asset in assets),
+            "assets": assets,
+        }
+
+
+# Shared by main.py, UI and PetAvatar
+assets = AssetManager()
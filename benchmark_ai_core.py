@@ -0,0 +1,259 @@
+"""
+Latency benchmark for ai_core / ai_engine against the fake Ollama server.
+
+Needs no real model, so it runs on any plain Linux CI box:
+    python benchmark_ai_core.py --requests 50 --concurrency 1 2 4 8
+
+Reports time-to-first-token, tokens/s, p50/p95/p99 end-to-end latency and
+the throughput of concurrent requests (thread pool on the sync client and
+the asyncio engine). With --resilience it instead takes the server down and
+lets it flap, and reports how fast requests fail and how soon they recover.
+"""
+import argparse
+import json
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import ai_core
+from ai_engine import AIEngine
+from fake_ollama_server import FakeOllamaServer
+from metrics import percentile
+
+
+def summarize(values):
+    return {
+        "mean": sum(values) / len(values) if values else 0.0,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else 0.0,
+    }
+
+
+def make_messages(i):
+    return [{"role": "user", "content": f"benchmark question number {i}"}]
+
+
+def bench_streaming(model, requests):
+    """Sequential streamed requests through ai_core.stream_model_response."""
+    ttfts, totals, rates = [], [], []
+    for i in range(requests):
+        started = time.perf_counter()
+        first = None
+        tokens = 0
+        for _ in ai_core.stream_model_response(make_messages(i), model):
+            if first is None:
+                first = time.perf_counter() - started
+            tokens += 1
+        total = time.perf_counter() - started
+        ttfts.append(first or total)
+        totals.append(total)
+        generation_time = total - (first or 0.0)
+        if tokens > 1 and generation_time > 0:
+            rates.append((tokens - 1) / generation_time)
+    return {
+        "requests": requests,
+        "ttft": summarize(ttfts),
+        "latency": summarize(totals),
+        "tokens_per_second": summarize(rates),
+    }
+
+
+def bench_thread_pool(model, requests, concurrency):
+    """Concurrent blocking requests through the shared sync client."""
+    def one(i):
+        started = time.perf_counter()
+        ai_core.get_model_response(make_messages(i), model, use_cache=False)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(one, range(requests)))
+    wall = time.perf_counter() - started
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "throughput_rps": requests / wall,
+        "latency": summarize(latencies),
+    }
+
+
+def bench_engine(engine, model, requests, concurrency):
+    """Requests kept `concurrency` at a time in flight on the asyncio engine."""
+    results = engine.results
+    submitted_at = {}
+    first_at = {}
+    latencies, ttfts = [], []
+    next_index = 0
+    finished = 0
+
+    def submit_next():
+        nonlocal next_index
+        job = engine.submit(make_messages(next_index), model)
+        submitted_at[job.id] = time.perf_counter()
+        next_index += 1
+
+    started = time.perf_counter()
+    while next_index < min(concurrency, requests):
+        submit_next()
+    while finished < requests:
+        job_id, status, _ = results.get(timeout=60)
+        now = time.perf_counter()
+        if status == "partial":
+            first_at.setdefault(job_id, now)
+            continue
+        finished += 1
+        latencies.append(now - submitted_at[job_id])
+        ttfts.append(first_at.get(job_id, now) - submitted_at[job_id])
+        if next_index < requests:
+            submit_next()
+    wall = time.perf_counter() - started
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "throughput_rps": requests / wall,
+        "ttft": summarize(ttfts),
+        "latency": summarize(latencies),
+    }
+
+
+def bench_resilience(server, model, requests, flap_seconds):
+    """Failure latency while the server is down, recovery time, and a flapping run."""
+    breaker = ai_core.backend_breaker
+
+    def timed_request(i):
+        started = time.perf_counter()
+        reply = ai_core.get_model_response(make_messages(i), model, use_cache=False)
+        return time.perf_counter() - started, reply != ai_core.CONNECTION_ERROR_REPLY
+
+    server.set_down(True)
+    down_latencies = [timed_request(i)[0] for i in range(requests)]
+    opened_after = next((i for i, latency in enumerate(down_latencies) if latency < 0.001), None)
+
+    server.set_down(False)
+    started = time.perf_counter()
+    while breaker.is_open and time.perf_counter() - started < 60:
+        time.sleep(0.01)
+    recovery = time.perf_counter() - started
+
+    # Up and down every flap_seconds; count what got through
+    server.flap_interval = flap_seconds
+    server.started_at = time.monotonic()
+    outcomes = {"ok": 0, "failed": 0, "fast_failed": 0}
+    flap_latencies = []
+    deadline = time.perf_counter() + flap_seconds * 6
+    i = 0
+    while time.perf_counter() < deadline:
+        was_open = breaker.is_open
+        latency, ok = timed_request(i)
+        i += 1
+        if ok:
+            outcomes["ok"] += 1
+            flap_latencies.append(latency)
+        else:
+            outcomes["fast_failed" if was_open and latency < 0.001 else "failed"] += 1
+            if latency < 0.001:
+                time.sleep(0.01)  # do not spin while the circuit is open
+    server.flap_interval = 0.0
+
+    return {
+        "first_failure": down_latencies[0],
+        "fast_failure": summarize(down_latencies[opened_after:] if opened_after is not None else []),
+        "requests_until_open": opened_after,
+        "recovery_seconds": recovery,
+        "flapping": dict(outcomes, latency=summarize(flap_latencies)),
+        "breaker": breaker.stats(),
+    }
+
+
+def format_ms(stats):
+    return " ".join(f"{key}={value * 1000:.1f}ms" for key, value in stats.items())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ai_core against a fake Ollama server.")
+    parser.add_argument("--requests", type=int, default=30, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--tokens", type=int, default=40, help="tokens per reply")
+    parser.add_argument("--first-token-delay", type=float, default=0.05)
+    parser.add_argument("--token-delay", type=float, default=0.005)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--model", default="llama3.2")
+    parser.add_argument("--json", dest="json_path", help="also write the results to this file")
+    parser.add_argument("--resilience", action="store_true",
+                        help="measure fail-fast and recovery against a server that goes down")
+    parser.add_argument("--flap-interval", type=float, default=1.0,
+                        help="up/down period of the flapping server in --resilience")
+    args = parser.parse_args()
+
+    # Keep benchmark runs away from the real response cache
+    ai_core.response_cache.cache_dir = None
+
+    report = {}
+    if args.resilience:
+        with FakeOllamaServer(tokens=args.tokens, first_token_delay=args.first_token_delay,
+                              token_delay=args.token_delay) as server:
+            previous_client = ai_core.set_client(ai_core.create_client(host=server.url))
+            try:
+                result = bench_resilience(server, args.model, args.requests, args.flap_interval)
+            finally:
+                ai_core.set_client(previous_client)
+        report["resilience"] = result
+        print(f"Server down: first failure after {result['first_failure'] * 1000:.1f}ms, "
+              f"circuit open after {result['requests_until_open']} requests")
+        print(f"  fast failures  {format_ms(result['fast_failure'])}")
+        print(f"  recovered {result['recovery_seconds']:.2f}s after the server came back")
+        flapping = result["flapping"]
+        print(f"Flapping: ok={flapping['ok']} failed={flapping['failed']} "
+              f"fast_failed={flapping['fast_failed']}  {format_ms(flapping['latency'])}")
+        if args.json_path:
+            with open(args.json_path, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+        return
+    with FakeOllamaServer(tokens=args.tokens, first_token_delay=args.first_token_delay,
+                          token_delay=args.token_delay, failure_rate=args.failure_rate) as server:
+        # Size the pools for the highest concurrency so they do not cap the results
+        pool_size = max([ai_core.MAX_CONNECTIONS] + args.concurrency)
+        previous_client = ai_core.set_client(
+            ai_core.create_client(host=server.url, max_connections=pool_size))
+        engine = AIEngine(queue.Queue(), stream_push_fps=0)
+        engine.set_client(ai_core.create_async_client(host=server.url, max_connections=pool_size))
+        try:
+            # One untimed request so connection setup is not measured
+            ai_core.get_model_response(make_messages(-1), args.model, use_cache=False)
+
+            streaming = bench_streaming(args.model, args.requests)
+            report["streaming"] = streaming
+            print(f"Streaming ({args.requests} sequential requests)")
+            print(f"  TTFT     {format_ms(streaming['ttft'])}")
+            print(f"  latency  {format_ms(streaming['latency'])}")
+            rate = streaming["tokens_per_second"]
+            print(f"  tokens/s mean={rate['mean']:.1f} p50={rate['p50']:.1f}")
+
+            report["thread_pool"] = []
+            report["engine"] = []
+            for concurrency in args.concurrency:
+                pooled = bench_thread_pool(args.model, args.requests, concurrency)
+                report["thread_pool"].append(pooled)
+                print(f"Thread pool x{concurrency}: {pooled['throughput_rps']:.1f} req/s  "
+                      f"{format_ms(pooled['latency'])}")
+
+                engined = bench_engine(engine, args.model, args.requests, concurrency)
+                report["engine"].append(engined)
+                print(f"Engine      x{concurrency}: {engined['throughput_rps']:.1f} req/s  "
+                      f"TTFT p50={engined['ttft']['p50'] * 1000:.1f}ms  "
+                      f"{format_ms(engined['latency'])}")
+        finally:
+            engine.stop()
+            ai_core.set_client(previous_client)
+        report["server"] = {"requests": server.request_count, "failures": server.failure_count}
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.json_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import random
+import sys
+import threading
+import time
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def backoff_delay(attempt, base=0.25, cap=4.0, rng=random):
+    """
+    Delay before retry number attempt (0-based): exponential with full jitter.
+
+    The upper bound doubles every attempt up to cap, and the actual delay is
+    drawn uniformly below it so that clients retrying together spread out.
+    """
+    return rng.uniform(0, min(cap, base * (2 ** min(attempt, 16))))
+
+
+class CircuitBreaker:
+    """Tracks the health of a backend and fails fast while it is down.
+
+    After failure_threshold consecutive failures the circuit opens and
+    allow() returns False without touching the network. If a probe callable
+    is given, a background thread calls it with exponential backoff and
+    closes the circuit as soon as it succeeds; without a probe the circuit
+    goes half-open after reset_timeout and lets one trial request through
+    (as it also does should the probe thread ever stop).
+    """
+
+    def __init__(self, failure_threshold=3, reset_timeout=5.0, probe=None,
+                 probe_interval=1.0, probe_max_interval=30.0, name="backend"):
+        """
+        Args:
+            failure_threshold: Consecutive failures that open the circuit
+            reset_timeout: Seconds before a trial request (used without a probe)
+            probe: Optional callable returning True when the backend is back
+            probe_interval: First delay between probes (seconds)
+            probe_max_interval: Upper bound of the probe backoff (seconds)
+            name: Name used in log messages
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe = probe
+        self.probe_interval = probe_interval
+        self.probe_max_interval = probe_max_interval
+        self.name = name
+
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+        # Counters
+        self.times_opened = 0
+        self.short_circuited = 0
+
+    @property
+    def is_open(self):
+        return self.state != CLOSED
+
+    def allow(self):
+        """Return True if a request may be sent to the backend now."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            # Without a running probe (none configured, or it stopped) a trial
+            # request is let through once reset_timeout has passed
+            if (self.state == OPEN and not self._probing
+                    and time.monotonic() - self.opened_at >= self.reset_timeout):
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return True
+            self.short_circuited += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._trial_running = False
+            if self.state != CLOSED:
+                self.state = CLOSED
+                print(f"{self.name} is reachable again", file=sys.stderr)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.state == HALF_OPEN or (
+                    self.state == CLOSED and self.failures >= self.failure_threshold):
+                self._open()
+
+    def _open(self):
+        # Called with the lock held
+        if self.state != OPEN:
+            self.times_opened += 1
+            print(f"{self.name} is unreachable; failing fast until it recovers", file=sys.stderr)
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        if self.probe is not None and not self._probing:
+            self._probing = True
+            threading.Thread(target=self._probe_loop, name=f"{self.name}-probe",
+                             daemon=True).start()
+
+    def _probe_loop(self):
+        attempt = 0
+        try:
+            while True:
+                # The exponent is capped so the delay never overflows a float
+                delay = min(self.probe_max_interval, self.probe_interval * (2 ** min(attempt, 16)))
+                time.sleep(delay * random.uniform(0.5, 1.0))
+                try:
+                    healthy = self.probe()
+                except Exception:
+                    healthy = False
+                if healthy:
+                    with self._lock:
+                        self._probing = False
+                    self.record_success()
+                    return
+                attempt += 1
+        finally:
+            # Whatever ends the loop, a later failure must be able to start a new one
+            with self._lock:
+                self._probing = False
+
+    def stats(self):
+        """Return the breaker state and counters as a dict."""
+        with self._lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "times_opened": self.times_opened,
+                "short_circuited": self.short_circuited,
+            }
@@ -0,0 +1,322 @@
+"""
+A local stand-in for the Ollama HTTP API, for benchmarks and offline testing.
+
+It speaks enough of the protocol for ai_core and ai_engine: /api/chat and
+/api/generate (streamed as NDJSON or as a single JSON body), /api/embed,
+/api/version, /api/ps and /api/tags. Replies are made of dummy tokens
+produced with configurable delays, and requests can be made to fail, or
+the whole server can be taken down (503 on every route) or made to flap.
+
+Run it on its own with:
+    python fake_ollama_server.py --port 11434 --token-delay 0.02
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeOllamaServer:
+    """Threaded fake Ollama server with configurable latency and failures."""
+
+    def __init__(self, host="127.0.0.1", port=0, tokens=40, first_token_delay=0.05,
+                 token_delay=0.01, load_delay=0.0, failure_rate=0.0, embed_dim=64, seed=None,
+                 flap_interval=0.0):
+        """
+        Args:
+            host: Interface to listen on
+            port: Port to listen on (0 picks a free one)
+            tokens: Number of tokens in every reply (options.num_predict can lower it)
+            first_token_delay: Seconds of simulated prompt processing before the first token
+            token_delay: Seconds between generated tokens
+            load_delay: Seconds of simulated model load on the first request per model
+            failure_rate: Probability (0-1) that a request fails with HTTP 500
+            embed_dim: Size of the vectors returned by /api/embed
+            seed: Seed for the failure random generator
+            flap_interval: If set, the server alternates between up and down
+                every flap_interval seconds, starting up
+        """
+        self.tokens = tokens
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.load_delay = load_delay
+        self.failure_rate = failure_rate
+        self.embed_dim = embed_dim
+        self.flap_interval = flap_interval
+        self.random = random.Random(seed)
+        self.forced_down = False
+        self.started_at = time.monotonic()
+
+        self.loaded_models = set()
+        self.request_count = 0
+        self.failure_count = 0
+        self.rejected_count = 0  # requests answered with 503 while down
+        self._lock = threading.Lock()
+
+        handler = type("Handler", (_FakeOllamaHandler,), {"fake": self})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serve requests on a background thread."""
+        self.started_at = time.monotonic()
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    # ------------------------------------------------------------------
+    # Behaviour hooks
+    # ------------------------------------------------------------------
+    @property
+    def down(self):
+        """True while the server rejects every request."""
+        if self.forced_down:
+            return True
+        if self.flap_interval:
+            return int((time.monotonic() - self.started_at) / self.flap_interval) % 2 == 1
+        return False
+
+    def set_down(self, down):
+        """Take the server down (or bring it back) regardless of flapping."""
+        self.forced_down = down
+
+    def should_fail(self):
+        """Decide whether the current request fails."""
+        with self._lock:
+            self.request_count += 1
+            failed = self.random.random() < self.failure_rate
+            if failed:
+                self.failure_count += 1
+            return failed
+
+    def load_model(self, model):
+        """Simulate loading a model; returns the load time in seconds."""
+        with self._lock:
+            cold = model not in self.loaded_models
+            self.loaded_models.add(model)
+        if cold and self.load_delay:
+            time.sleep(self.load_delay)
+            return self.load_delay
+        return 0.0
+
+    def embedding(self, text):
+        """Deterministic pseudo-embedding so equal texts get equal vectors."""
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        rng = random.Random(digest)
+        return [rng.uniform(-1.0, 1.0) for _ in range(self.embed_dim)]
+
+
+class _FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, chunked streaming
+    disable_nagle_algorithm = True  # small NDJSON chunks must not wait for ACKs
+    fake = None  # set on the subclass created by FakeOllamaServer
+
+    def log_message(self, format, *args):
+        pass  # keep benchmark output readable
+
+    def handle_one_request(self):
+        try:
+            super().handle_one_request()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client closed a stream early (cancellation); nothing to report
+            self.close_connection = True
+
+    def _reject_if_down(self):
+        if not self.fake.down:
+            return False
+        with self.fake._lock:
+            self.fake.rejected_count += 1
+        self._send_json({"error": "server unavailable"}, 503)
+        return True
+
+    # ------------------------------------------------------------------
+    # Response helpers
+    # ------------------------------------------------------------------
+    def _send_json(self, data, status=200):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_stream(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _send_chunk(self, data):
+        line = (json.dumps(data) + "\n").encode("utf-8")
+        self.wfile.write(f"{len(line):X}\r\n".encode("ascii") + line + b"\r\n")
+        self.wfile.flush()
+
+    def _end_stream(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    # ------------------------------------------------------------------
+    # Routes
+    # ------------------------------------------------------------------
+    def do_GET(self):
+        if self._reject_if_down():
+            return
+        if self.path == "/api/version":
+            self._send_json({"version": "0.0.0-fake"})
+        elif self.path == "/api/ps":
+            models = [{"name": m, "model": m} for m in sorted(self.fake.loaded_models)]
+            self._send_json({"models": models})
+        elif self.path == "/api/tags":
+            self._send_json({"models": []})
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        try:
+            request = self._read_body()
+        except ValueError:
+            self._send_json({"error": "invalid JSON"}, 400)
+            return
+        if self._reject_if_down():
+            return
+
+        if self.path == "/api/embed":
+            texts = request.get("input") or []
+            if isinstance(texts, str):
+                texts = [texts]
+            self._send_json({
+                "model": request.get("model", ""),
+                "embeddings": [self.fake.embedding(t) for t in texts],
+            })
+            return
+
+        if self.path not in ("/api/chat", "/api/generate"):
+            self._send_json({"error": "not found"}, 404)
+            return
+
+        if self.fake.should_fail():
+            self._send_json({"error": "simulated server failure"}, 500)
+            return
+
+        self._generate(request, chat=self.path == "/api/chat")
+
+    def _generate(self, request, chat):
+        model = request.get("model", "")
+        options = request.get("options") or {}
+        stream = request.get("stream", True)
+        started = time.perf_counter()
+
+        load_seconds = self.fake.load_model(model)
+
+        if chat:
+            prompt_text = " ".join(str(m.get("content", "")) for m in request.get("messages") or [])
+        else:
+            prompt_text = request.get("prompt") or ""
+        prompt_tokens = len(prompt_text.split())
+
+        num_predict = options.get("num_predict")
+        tokens = self.fake.tokens if num_predict is None or num_predict < 0 else min(
+            self.fake.tokens, num_predict)
+        # An empty generate request only loads the model
+        if not chat and not prompt_text:
+            tokens = 0
+
+        prompt_started = time.perf_counter()
+        if prompt_tokens or chat:
+            time.sleep(self.fake.first_token_delay)
+        prompt_seconds = time.perf_counter() - prompt_started
+
+        def piece(text, done=False):
+            data = {"model": model, "created_at": "2024-01-01T00:00:00Z", "done": done}
+            if chat:
+                data["message"] = {"role": "assistant", "content": text}
+            else:
+                data["response"] = text
+            return data
+
+        eval_started = time.perf_counter()
+        words = []
+        if stream:
+            self._start_stream()
+        for i in range(tokens):
+            if i:
+                time.sleep(self.fake.token_delay)
+            word = f"tok{i} "
+            words.append(word)
+            if stream:
+                self._send_chunk(piece(word))
+        eval_seconds = time.perf_counter() - eval_started
+
+        final = piece("" if stream else "".join(words), done=True)
+        final.update({
+            "done_reason": "stop",
+            "total_duration": int((time.perf_counter() - started) * 1e9),
+            "load_duration": int(load_seconds * 1e9),
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": int(prompt_seconds * 1e9),
+            "eval_count": tokens,
+            "eval_duration": int(eval_seconds * 1e9),
+        })
+        if not chat:
+            final["context"] = list(range(prompt_tokens + tokens))
+
+        if stream:
+            self._send_chunk(final)
+            self._end_stream()
+        else:
+            self._send_json(final)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake Ollama server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--tokens", type=int, default=40)
+    parser.add_argument("--first-token-delay", type=float, default=0.05)
+    parser.add_argument("--token-delay", type=float, default=0.01)
+    parser.add_argument("--load-delay", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--flap-interval", type=float, default=0.0,
+                        help="alternate between up and down every this many seconds")
+    args = parser.parse_args()
+
+    server = FakeOllamaServer(
+        args.host, args.port, args.tokens, args.first_token_delay, args.token_delay,
+        args.load_delay, args.failure_rate, flap_interval=args.flap_interval,
+    )
+    print(f"Fake Ollama server listening on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+Turns dropped files into context for the next prompt.
+
+Files are read chunk by chunk (memory-mapped when large), so even a
+multi-hundred-megabyte log never has to fit in memory. Small files are
+attached as they are; larger ones are summarized map-reduce style: every
+chunk is summarized on a worker pool, then the partial summaries are merged
+until they fit the attachment budget. Results are cached on the file's
+path, modification time and size.
+"""
+import hashlib
+import mmap
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import ai_core
+from response_cache import ResponseCache
+
+
+INGEST_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "ingest")
+# Files up to this many (approximate) tokens are attached without summarizing
+ATTACHMENT_MAX_TOKENS = 768
+# Size of the pieces a large file is cut into for the map step
+CHUNK_TOKENS = 1024
+# Larger files are sampled: this many evenly spaced chunks are summarized
+MAX_MAP_CHUNKS = 32
+# Parallel summarization requests
+INGEST_WORKERS = 2
+# Files at least this big are memory-mapped instead of read
+MMAP_THRESHOLD = 1024 * 1024
+# Chunk boundaries are moved to the next newline if one is this close
+LINE_SEARCH_BYTES = 1024
+CHUNK_SUMMARY_TOKENS = 160
+CHUNK_SUMMARY_PROMPT = (
+    "Summarize this part of the file {name} in a few sentences. Keep names, numbers, "
+    "errors and anything unusual."
+)
+MERGE_SUMMARY_PROMPT = (
+    "These are summaries of consecutive parts of the file {name}. Merge them into one "
+    "summary of the whole file."
+)
+
+
+def _is_binary(sample):
+    return b"\0" in sample
+
+
+def _line_start(data, pos, size):
+    """Move pos to the start of the next line, if one starts close by."""
+    if pos <= 0:
+        return 0
+    if pos >= size:
+        return size
+    newline = data.find(b"\n", pos - 1, min(size, pos + LINE_SEARCH_BYTES))
+    return pos if newline < 0 else newline + 1
+
+
+def iter_chunks(path, chunk_tokens=CHUNK_TOKENS, max_chunks=None):
+    """
+    Yield (index, total, text) for the chunks of a text file.
+
+    Chunks hold roughly chunk_tokens tokens and end on line boundaries where
+    possible. When the file has more than max_chunks chunks, only that many
+    evenly spaced ones are read.
+
+    Raises:
+        ValueError: If the file looks binary.
+    """
+    size = os.path.getsize(path)
+    if not size:
+        return
+    chunk_bytes = chunk_tokens * 4  # matches ai_core.estimate_tokens
+    total = -(-size // chunk_bytes)
+    if max_chunks and total > max_chunks:
+        step = total / max_chunks
+        indices = [int(i * step) for i in range(max_chunks)]
+    else:
+        indices = range(total)
+
+    with open(path, "rb") as f:
+        if _is_binary(f.read(8192)):
+            raise ValueError("binary file")
+        f.seek(0)
+        if size >= MMAP_THRESHOLD:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            data = f.read()
+        try:
+            for index in indices:
+                start = _line_start(data, index * chunk_bytes, size)
+                end = _line_start(data, (index + 1) * chunk_bytes, size)
+                if end > start:
+                    yield index, total, data[start:end].decode("utf-8", errors="replace")
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+
+
+class FileIngestor:
+    """Reads and summarizes dropped files off the UI thread.
+
+    ingest() returns immediately; finished attachments are collected with
+    poll() once per frame. Each attachment is a dict with "path", "name",
+    "text", "tokens", "summarized", "sampled" and "cached", or has an
+    "error" message instead of "text".
+    """
+
+    def __init__(self, model_name="llama3.2", workers=INGEST_WORKERS, cache_dir=INGEST_CACHE_DIR):
+        """
+        Args:
+            model_name: Model used to summarize large files
+            workers: Number of chunks summarized in parallel
+            cache_dir: Directory of the ingestion cache (None keeps it in memory)
+        """
+        self.model_name = model_name
+        self.cache = ResponseCache(cache_dir, max_memory_entries=64)
+        self.results = queue.Queue()
+        # One file at a time; its chunks fan out over the worker pool
+        self._files = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest")
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest-map")
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    @property
+    def busy(self):
+        with self._lock:
+            return bool(self._pending)
+
+    def ingest(self, path):
+        """Queue a file for reading. Returns False if it is already queued."""
+        path = os.path.abspath(path)
+        with self._lock:
+            if path in self._pending:
+                return False
+            self._pending.add(path)
+        self._files.submit(self._run, path)
+        return True
+
+    def poll(self):
+        """Return the attachments finished since the last call."""
+        finished = []
+        while True:
+            try:
+                finished.append(self.results.get_nowait())
+            except queue.Empty:
+                return finished
+
+    def stop(self):
+        self._files.shutdown(wait=False, cancel_futures=True)
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    # ------------------------------------------------------------------
+    # Worker side
+    # ------------------------------------------------------------------
+    def _cache_key(self, path, stat):
+        raw = f"{path}|{stat.st_mtime_ns}|{stat.st_size}|{self.model_name}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _run(self, path):
+        name = os.path.basename(path)
+        try:
+            stat = os.stat(path)
+            key = self._cache_key(path, stat)
+            attachment = self.cache.get(key)
+            if attachment is not None:
+                attachment = dict(attachment, cached=True)
+            else:
+                attachment = self._read(path, name, stat.st_size)
+                self.cache.put(key, attachment)
+                attachment = dict(attachment, cached=False)
+        except (OSError, ValueError, RuntimeError) as exc:
+            attachment = {"path": path, "name": name, "error": str(exc)}
+        finally:
+            with self._lock:
+                self._pending.discard(path)
+        self.results.put(attachment)
+
+    def _read(self, path, name, size):
+        attachment = {"path": path, "name": name, "summarized": False, "sampled": False}
+        if size // 4 <= ATTACHMENT_MAX_TOKENS:
+            text = "".join(chunk for _, _, chunk in iter_chunks(path)).strip()
+            attachment.update(text=text, tokens=ai_core.estimate_tokens(text))
+            return attachment
+
+        # Map: summarize the chunks in parallel, reading them lazily
+        futures = []
+        total = 0
+        for index, total, chunk in iter_chunks(path, CHUNK_TOKENS, MAX_MAP_CHUNKS):
+            prompt = CHUNK_SUMMARY_PROMPT.format(name=name)
+            futures.append(self._pool.submit(self._summarize, prompt, chunk, CHUNK_SUMMARY_TOKENS))
+        summaries = [future.result() for future in futures]
+        sampled = len(summaries) < total
+
+        # Reduce: merge neighbouring summaries until they fit the budget
+        merge_prompt = MERGE_SUMMARY_PROMPT.format(name=name)
+        while len(summaries) > 1 and ai_core.estimate_tokens("\n\n".join(summaries)) > ATTACHMENT_MAX_TOKENS:
+            groups = self._group(summaries, CHUNK_TOKENS)
+            if len(groups) == len(summaries):
+                groups = [summaries[i:i + 2] for i in range(0, len(summaries), 2)]
+            futures = [
+                self._pool.submit(self._summarize, merge_prompt, "\n\n".join(group), CHUNK_SUMMARY_TOKENS)
+                for group in groups
+            ]
+            summaries = [future.result() for future in futures]
+        if len(summaries) > 1:
+            summaries = [self._summarize(merge_prompt, "\n\n".join(summaries), ATTACHMENT_MAX_TOKENS)]
+
+        text = summaries[0] if summaries else ""
+        attachment.update(text=text, tokens=ai_core.estimate_tokens(text), summarized=True,
+                          sampled=sampled)
+        return attachment
+
+    @staticmethod
+    def _group(texts, max_tokens):
+        """Split texts into consecutive groups of at most max_tokens each."""
+        groups, current, current_tokens = [], [], 0
+        for text in texts:
+            tokens = ai_core.estimate_tokens(text)
+            if current and current_tokens + tokens > max_tokens:
+                groups.append(current)
+                current, current_tokens = [], 0
+            current.append(text)
+            current_tokens += tokens
+        if current:
+            groups.append(current)
+        return groups
+
+    def _summarize(self, instruction, text, max_tokens):
+        messages = [
+            {"role": "system", "content": instruction},
+            {"role": "user", "content": text},
+        ]
+        reply = ai_core.get_model_response(messages, self.model_name,
+                                           options={"num_predict": max_tokens})
+        if not reply or reply == ai_core.CONNECTION_ERROR_REPLY:
+            raise RuntimeError("could not summarize the file")
+        return reply.strip()
+
+
+def format_attachments(attachments):
+    """Text block presenting attached files to the model, or "" for none."""
+    blocks = []
+    for attachment in attachments:
+        if attachment.get("summarized"):
+            kind = "summary of a sample of the file" if attachment.get("sampled") else "summary"
+            header = f"[Attached file {attachment['name']} ({kind})]"
+        else:
+            header = f"[Attached file {attachment['name']}]"
+        blocks.append(f"{header}\n{attachment['text']}")
+    return "\n\n".join(blocks)
@@ -2,6 +2,7 @@ import pygame
 import win32clipboard
 import win32con
 from collections import deque
+from text_layout import prefix_widths
 
 
 class InputHandler:
@@ -133,10 +134,7 @@ class InputHandler:
             return 0
 
         font = self.text_input_render_info["font"]
-        for index in range(len(self.text_input) + 1):
-            if font.size(self.text_input[:index])[0] >= rel_x:
-                return index
-        return len(self.text_input)
+        return prefix_widths(font, self.text_input).index_at(rel_x)
 
     def _select_word(self, click_index):
         if not self.text_input:
@@ -2,12 +2,17 @@ import pygame
 import win32gui
 import win32con
 import win32api
-import threading
+import os
 import queue
+from assets import assets
 from pet_avatar import PetAvatar
-from ui import UI
+from ui import UI, FramePresenter
 from input_handler import InputHandler
 import ai_core
+from ai_engine import AIEngine
+from request_scheduler import RequestScheduler
+from model_router import ModelRouter
+from file_ingest import FileIngestor, format_attachments
 import win32clipboard
 
 # -------------------------
@@ -17,6 +22,26 @@ W, H = win32api.GetSystemMetrics(0), win32api.GetSystemMetrics(1)
 FPS = 60
 TRANSPARENT_COLOR = (255, 0, 255)
 SPEED = 260
+# Streaming replies are pushed to the UI at most this many times per second.
+# The render loop runs at FPS, so anything above it would only be wasted work.
+STREAM_PUSH_FPS = 30
+# Prompts submitted while a reply is pending wait in a queue of this size.
+# Shift+Enter skips the queue and cancels the reply in progress.
+MAX_PENDING_REQUESTS = 8
+# Old turns are summarized in the background once the user has been idle this long
+COMPACT_IDLE_DELAY = 4000  # ms
+# Keep the model's KV context between turns so only the new message is prefilled
+REUSE_MODEL_CONTEXT = True
+# Send the conversation history to the model while the user is still typing,
+# so only the new message is left to process when it is submitted
+SPECULATIVE_PREFILL = False
+PREFILL_DEBOUNCE = 600  # ms without keystrokes before prefilling
+# With nothing moving for ACTIVE_LINGER ms the loop stops ticking at FPS and
+# sleeps until an event arrives, waking at least every IDLE_WAKE_INTERVAL ms
+ACTIVE_LINGER = 1500      # ms
+IDLE_WAKE_INTERVAL = 100  # ms
+# Per-request timing is written here on exit
+METRICS_EXPORT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs", "metrics")
 
 # Menu Visual Config
 MENU_WIDTH = 120
@@ -36,8 +61,10 @@ screen = pygame.display.set_mode((W, H), pygame.NOFRAME)
 pet_avatar = PetAvatar()
 pet_avatar.set_eye_mode(2)
 PET_RADIUS = pet_avatar.pet_radius
-ui = UI()
+ui = UI(pet_avatar=pet_avatar)
 input_handler = InputHandler(PET_RADIUS)
+# Only the areas drawn in this or the previous frame are cleared and presented
+presenter = FramePresenter(screen, TRANSPARENT_COLOR)
 
 def activate_window(hwnd):
     win32gui.ShowWindow(hwnd, win32con.SW_RESTORE)
@@ -66,9 +93,63 @@ x, y = W * 0.5, H * 0.6
 
 # AI loading state
 ai_loading = False
+ai_streaming = False       # True once the first streamed chunk has arrived
 ai_reply = None
 ai_error = None
 ai_queue = queue.Queue()  # thread‑safe communication
+AI_RESULT_EVENT = pygame.event.custom_type()  # posted whenever ai_queue gets a result
+
+def notify_ai_result():
+    """Wake the main loop up; called by the engine thread after each result."""
+    pygame.event.post(pygame.event.Event(AI_RESULT_EVENT))
+
+ai_engine = AIEngine(ai_queue, stream_push_fps=STREAM_PUSH_FPS, memory=ai_core.open_memory(),
+                     notify=notify_ai_result)
+ai_engine.start()
+conversation = ai_core.Conversation()  # multi-turn memory shared with the CLI
+compactor = ai_core.ConversationCompactor(conversation)
+router = ModelRouter()  # picks the fast or the large model per request
+context_session = ai_core.ContextSession() if REUSE_MODEL_CONTEXT else None
+prefiller = ai_core.PromptPrefiller(conversation, context_session) if SPECULATIVE_PREFILL else None
+ingestor = FileIngestor(router.fast_model)  # reads dropped files in the background
+pending_attachments = []  # Files attached to the next prompt
+last_ai_activity_time = 0  # Timestamp of the last submission or reply (ms)
+
+def start_request(user_text):
+    """Start answering a prompt taken from the scheduler queue."""
+    # A live request always wins over background summarization
+    compactor.cancel()
+    if pending_attachments:
+        user_text = format_attachments(pending_attachments) + "\n\n" + user_text
+        pending_attachments.clear()
+    conversation.add_user(user_text)
+    messages = conversation.messages()
+    decision = router.choose(messages)
+    if decision["warm_up"]:
+        # Load the large model in the background for the next requests
+        router.track_warmup(ai_engine.warmup(decision["warm_up"]), decision["warm_up"])
+    cached_reply = ai_core.get_cached_response(messages, decision["model"])
+    if cached_reply is not None:
+        # Cache hit: answer right away without involving the model
+        return ai_engine.submit_result(cached_reply)
+    if prefiller:
+        prefiller.claim(decision["model"])
+    # Hand a snapshot of the history to the background engine
+    plan = context_session.plan(conversation, decision["model"]) if context_session else None
+    job = ai_engine.submit(messages, decision["model"], use_memory=True,
+                           session=context_session, plan=plan, queue_wait=scheduler.last_wait)
+    router.started(job, decision)
+    return job
+
+scheduler = RequestScheduler(start_request, max_pending=MAX_PENDING_REQUESTS)
+
+def attach_dropped_file(path):
+    """Start reading a dropped file; returns False if it is not a regular file."""
+    if not os.path.isfile(path):
+        return False
+    if ingestor.ingest(path):
+        print("Reading", path)
+    return True
 
 # Text box state
 display_text = ""          # Will be updated with AI reply or other content
@@ -78,20 +159,32 @@ box_rect = None
 last_interaction_time = 0  # Timestamp of last mouse hover or new reply (ms)
 TEXT_BOX_DISPLAY_DURATION = 10000  # 10 seconds
 
-def ai_worker(user_text):
-    """Run AI model in a separate thread."""
-    try:
-        history = [{"role": "user", "content": user_text}]
-        reply = ai_core.get_model_response(history)
-        ai_queue.put(("success", reply))
-    except Exception as e:
-        ai_queue.put(("error", str(e)))
+# Speculative prefill state
+last_input_text = ""
+last_input_change_time = 0
+prefill_armed = False      # The draft changed since the last prefill check
+rendered_job_ids = []      # Finished replies shown for the first time this frame
+
+# Adaptive frame rate state
+last_activity_time = 0     # Timestamp of the last input, animation or AI activity (ms)
+last_cursor_pos = None
+
+# Load the model while the pet is starting up instead of on the first question
+router.track_warmup(ai_engine.warmup(router.fast_model), router.fast_model)
 
 running = True
 while running:
+    events = []
+    if pygame.time.get_ticks() - last_activity_time < ACTIVE_LINGER:
+        dt = clock.tick(FPS) / 1000.0
+    else:
+        # Nothing is changing: sleep until an event arrives or the idle interval passes
+        event = pygame.event.wait(IDLE_WAKE_INTERVAL)
+        if event.type != pygame.NOEVENT:
+            events.append(event)
+        dt = clock.tick() / 1000.0
     current_time = pygame.time.get_ticks()
     mouse_pos = pygame.mouse.get_pos()
-    dt = clock.tick(FPS) / 1000.0
 
     is_hovering = input_handler.is_mouse_hovering(x, y)
     is_over_text_input = input_handler.is_mouse_over_text_input()
@@ -103,14 +196,29 @@ while running:
         last_interaction_time = current_time
 
     # Handle all input events
-    events = pygame.event.get()
+    events += pygame.event.get()
+
+    # Run at full frame rate while anything moves; the eyes follow the cursor
+    # anywhere on the desktop, so its global position counts too
+    cursor_pos = win32api.GetCursorPos()
+    if (events or cursor_pos != last_cursor_pos or input_handler.dragging or scheduler.busy
+            or (input_handler.menu_open and input_handler.menu_anim_height < MENU_FULL_HEIGHT)):
+        last_activity_time = current_time
+    last_cursor_pos = cursor_pos
     for event in events:
         if event.type == pygame.DROPFILE:
-            input_handler.insert_text(event.file)
+            if not attach_dropped_file(event.file):
+                input_handler.insert_text(event.file)
             show_text_input = True
         elif event.type == pygame.DROPTEXT:
             input_handler.insert_text(event.text)
             show_text_input = True
+        elif event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE and ai_loading:
+            # Escape aborts the reply that is currently being generated
+            scheduler.cancel_inflight()
+        elif event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+            # The window contents were lost; repaint everything once
+            presenter.invalidate()
         elif event.type == pygame.MOUSEWHEEL and mouse_over_text_box:
             # Adjust scroll based on wheel direction
             text_box_scroll -= event.y * 20  # Negative y is scroll down
@@ -142,7 +250,7 @@ while running:
         win32con.PM_REMOVE
     )
     if drop_message and len(drop_message) >= 5:
-        msg, wparam, lparam, time, pt = drop_message
+        msg, wparam, lparam, msg_time, pt = drop_message
         if msg == win32con.WM_DROPFILES:
             file_count = win32gui.DragQueryFile(wparam, -1)
             dropped_files = [
@@ -150,44 +258,113 @@ while running:
                 for i in range(file_count)
             ]
             win32gui.DragFinish(wparam)
+            other_paths = [path for path in dropped_files if not attach_dropped_file(path)]
+            if other_paths:
+                input_handler.insert_text("\n".join(other_paths))
             if dropped_files:
-                input_handler.insert_text("\n".join(dropped_files))
                 show_text_input = True
 
     event_result = input_handler.handle_events(events, x, y, MENU_WIDTH, MENU_FULL_HEIGHT, W, H, hwnd)
 
-    # Process text input and possibly start AI thread
+    # Process text input; prompts submitted while busy wait in the scheduler
     submitted_text = input_handler.handle_text_input(events, show_text_input)
-    if submitted_text and not ai_loading:
+    if input_handler.text_input != last_input_text:
+        last_input_text = input_handler.text_input
+        last_input_change_time = current_time
+        prefill_armed = True
+    if submitted_text:
+        last_ai_activity_time = current_time
         print("You:", submitted_text)
-        ai_loading = True
-        # Start AI in a background thread
-        thread = threading.Thread(target=ai_worker, args=(submitted_text,))
-        thread.daemon = True
-        thread.start()
-
-    # Check if AI thread has finished
-    if ai_loading:
+        preempt = bool(pygame.key.get_mods() & pygame.KMOD_SHIFT)
+        if not scheduler.submit(submitted_text, preempt=preempt):
+            print("Too many pending requests; dropped:", submitted_text)
+    scheduler.pump()
+    ai_loading = scheduler.inflight_count > 0
+
+    # Drain everything the AI engine has produced since it last woke us up
+    ai_results_ready = any(event.type == AI_RESULT_EVENT for event in events)
+    while ai_results_ready:
         try:
-            status, result = ai_queue.get_nowait()
-            if status == "success":
-                ai_reply = result
-                print("Assistant:", ai_reply)
-                # Update display_text with the reply
-                display_text = ai_reply
+            job_id, status, result = ai_queue.get_nowait()
+        except queue.Empty:
+            break  # still loading
+        if status == "warmup":
+            router.handle_warmup(job_id, result)
+            continue
+        if prefiller and prefiller.handle_result(job_id, status, result):
+            continue
+        if compactor.handle_result(job_id, status, result):
+            continue
+        if not scheduler.is_active(job_id):
+            continue  # stale result from a cancelled job
+        if status == "partial":
+            router.first_token(job_id)
+            if not ai_streaming:
+                ai_streaming = True
                 # Reset scroll for new content
                 text_box_scroll = 0
-                # Reset interaction timer so box appears
-                last_interaction_time = current_time
+            display_text = result
+            last_interaction_time = current_time
+            continue
+        if status == "success":
+            ai_reply = result
+            print("Assistant:", ai_reply)
+            if ai_reply and ai_reply != ai_core.CONNECTION_ERROR_REPLY:
+                conversation.add_assistant(ai_reply)
             else:
-                ai_error = result
-                print("AI error:", ai_error)
-                display_text = f"Error: {ai_error}"
+                conversation.discard_pending()
+            # Update display_text with the reply
+            display_text = ai_reply
+            if not ai_streaming:
+                # Reset scroll for new content
                 text_box_scroll = 0
-                last_interaction_time = current_time
-            ai_loading = False
-        except queue.Empty:
-            pass  # still loading
+            # Reset interaction timer so box appears
+            last_interaction_time = current_time
+        elif status == "cancelled":
+            print("AI request cancelled")
+            conversation.discard_pending()
+            display_text = (result + " ..." if result else "(cancelled)")
+            last_interaction_time = current_time
+        else:
+            ai_error = result
+            print("AI error:", ai_error)
+            conversation.discard_pending()
+            display_text = f"Error: {ai_error}"
+            text_box_scroll = 0
+            last_interaction_time = current_time
+        router.finished(job_id, status)
+        scheduler.finish(job_id)
+        rendered_job_ids.append(job_id)
+        ai_streaming = False
+        last_ai_activity_time = current_time
+        prefill_armed = True  # the history changed under the draft
+        # Start the next queued prompt, if any
+        scheduler.pump()
+        ai_loading = scheduler.inflight_count > 0
+
+    # Dropped files that have been read (and summarized) are attached to the next prompt
+    for attachment in ingestor.poll():
+        if "error" in attachment:
+            print(f"Could not read {attachment['path']}: {attachment['error']}")
+            display_text = f"Could not read {attachment['name']}: {attachment['error']}"
+        else:
+            pending_attachments.append(attachment)
+            detail = "summarized" if attachment["summarized"] else f"{attachment['tokens']} tokens"
+            display_text = f"Attached {attachment['name']} ({detail})"
+        text_box_scroll = 0
+        last_interaction_time = current_time
+
+    # Summarize old turns while the user is idle
+    if (not scheduler.busy and not input_handler.text_input and
+            current_time - last_ai_activity_time > COMPACT_IDLE_DELAY):
+        compactor.maybe_start(ai_engine)
+
+    # Prefill the history once the user pauses typing
+    if (prefiller and prefill_armed and input_handler.text_input and not scheduler.busy
+            and not compactor.running and current_time - last_input_change_time > PREFILL_DEBOUNCE):
+        prefill_armed = False
+        draft = conversation.messages() + [{"role": "user", "content": input_handler.text_input}]
+        prefiller.maybe_start(ai_engine, router.choose(draft)["model"])
 
     if event_result['quit']:
         running = False
@@ -201,14 +378,15 @@ while running:
     # Update menu animation
     input_handler.update_menu_animation(MENU_FULL_HEIGHT, ANIM_SPEED)
 
-    screen.fill(TRANSPARENT_COLOR)
+    presenter.clear()
 
     # Draw hover glow
     if is_hovering:
-        ui.draw_hover_glow(screen, x, y)
+        presenter.add(ui.draw_hover_glow(screen, x, y))
 
     # Draw pet avatar
-    pet_avatar.draw(screen, x, y)
+    pet_avatar.update_animation(current_time, ai_loading, ai_streaming, input_handler.dragging)
+    presenter.add(pet_avatar.draw(screen, x, y))
 
     # Draw text input box
     if show_text_input:
@@ -222,6 +400,7 @@ while running:
             input_handler.drag_drop_cursor_pos,
             font
         )
+        presenter.add(text_input_rect)
         input_handler.text_input_rect = text_input_rect
         input_handler.set_text_render_info(render_info)
     else:
@@ -229,25 +408,46 @@ while running:
         input_handler.set_text_render_info(None)
 
     # Draw context menu
-    ui.draw_menu(screen, input_handler, mouse_pos, MENU_WIDTH, MENU_FULL_HEIGHT,
-                 BUTTON_HEIGHT, COLOR_MENU_BG, COLOR_ACCENT, COLOR_TEXT, COLOR_HOVER, font)
+    presenter.add(ui.draw_menu(screen, input_handler, mouse_pos, MENU_WIDTH, MENU_FULL_HEIGHT,
+                               BUTTON_HEIGHT, COLOR_MENU_BG, COLOR_ACCENT, COLOR_TEXT, COLOR_HOVER, font))
 
-    # Draw typing indicator if AI is loading
-    if ai_loading:
-        ui.draw_typing_indicator(screen, x, y-12, current_time)
+    # Draw typing indicator until the first streamed chunk arrives
+    typing_active = ai_loading and not ai_streaming
+    if typing_active:
+        presenter.add(ui.draw_typing_indicator(screen, x, y-12, current_time))
+
+    # Show how many prompts are waiting behind the current one
+    presenter.add(ui.draw_queue_badge(screen, x, y, scheduler.queue_depth, font))
 
     # Draw the text box only if there is something to show and it's within the display duration
     time_since_last_interaction = current_time - last_interaction_time
     if display_text and time_since_last_interaction < TEXT_BOX_DISPLAY_DURATION:
         box_rect, total_text_height, scroll_needed = ui.draw_text_box(
-            screen, x, y-10, display_text, ai_loading, font, text_box_scroll
+            screen, x, y-10, display_text, typing_active, font, text_box_scroll
         )
+        presenter.add(box_rect)
         # Update mouse_over_text_box for next frame's event handling
         mouse_over_text_box = box_rect.collidepoint(mouse_pos)
     else:
         box_rect = None
         mouse_over_text_box = False
 
-    pygame.display.update()
-
+    presenter.present()
+
+    # Replies that just reached the screen complete their metrics record
+    for job_id in rendered_job_ids:
+        ai_core.request_metrics.mark_rendered(job_id)
+    rendered_job_ids.clear()
+
+print("Frame cost:", presenter.stats())
+print("Text cache:", ui.text_cache.stats())
+print("Assets:", assets.stats())
+if prefiller:
+    print("Prefill:", prefiller.stats())
+if len(ai_core.request_metrics):
+    ai_core.request_metrics.export_json(METRICS_EXPORT_PATH + ".json")
+    ai_core.request_metrics.export_csv(METRICS_EXPORT_PATH + ".csv")
+    print(f"Request metrics written to {METRICS_EXPORT_PATH}.json/.csv")
+ingestor.stop()
+ai_engine.stop()
 pygame.quit()
\ No newline at end of file
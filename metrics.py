@@ -0,0 +1,134 @@
+import csv
+import itertools
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+# Columns of an exported metrics record, in order
+FIELDS = [
+    "id", "time", "source", "model", "status", "cached",
+    "queue_wait", "ttft", "total", "render",
+    "load_duration", "prompt_eval_count", "prompt_eval_duration",
+    "eval_count", "eval_duration", "total_duration",
+    "prompt_tokens_per_second", "tokens_per_second",
+]
+# Numeric fields that get percentile summaries
+SUMMARY_FIELDS = [
+    "queue_wait", "ttft", "total", "render", "load_duration", "prompt_eval_duration",
+    "eval_duration", "total_duration", "prompt_tokens_per_second", "tokens_per_second",
+]
+_DURATION_FIELDS = ["load_duration", "prompt_eval_duration", "eval_duration", "total_duration"]
+
+
+def percentile(values, pct):
+    """Linear-interpolated percentile of values (pct in 0-100)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100.0
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def server_metrics(response):
+    """
+    Extract the timing fields of a final Ollama response.
+
+    Durations are converted from nanoseconds to seconds, and the prompt and
+    generation speeds are derived from them.
+    """
+    record = {key: (response.get(key) or 0) / 1e9 for key in _DURATION_FIELDS}
+    record["prompt_eval_count"] = response.get("prompt_eval_count") or 0
+    record["eval_count"] = response.get("eval_count") or 0
+    if record["prompt_eval_duration"]:
+        record["prompt_tokens_per_second"] = record["prompt_eval_count"] / record["prompt_eval_duration"]
+    if record["eval_duration"]:
+        record["tokens_per_second"] = record["eval_count"] / record["eval_duration"]
+    return record
+
+
+class MetricsStore:
+    """Rolling in-process store of per-request metrics records.
+
+    Records are plain dicts using the keys in FIELDS (missing keys mean
+    "not measured"). Only the newest max_records are kept.
+    """
+
+    def __init__(self, max_records=500):
+        self.max_records = max_records
+        self._records = OrderedDict()  # record key -> record
+        self._keys = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._records)
+
+    def add(self, record):
+        """Store a finished request's record (a "time" stamp is added if missing)."""
+        record.setdefault("time", time.time())
+        with self._lock:
+            key = record["id"] if record.get("id") is not None else ("anon", next(self._keys))
+            self._records[key] = record
+            self._records.move_to_end(key)
+            while len(self._records) > self.max_records:
+                self._records.popitem(last=False)
+
+    def mark_rendered(self, request_id):
+        """Record how long after it finished a request's reply reached the screen."""
+        with self._lock:
+            record = self._records.get(request_id)
+            if record is not None and "finished_at" in record and "render" not in record:
+                record["render"] = time.perf_counter() - record["finished_at"]
+
+    def records(self):
+        """Return copies of the stored records, oldest first."""
+        with self._lock:
+            return [{key: record.get(key) for key in FIELDS} for record in self._records.values()]
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+
+    def summary(self):
+        """
+        Summarize the stored records.
+
+        Returns:
+            Dict with "count", "by_status" and, for every measured field of
+            SUMMARY_FIELDS, its "mean", "p50", "p95", "p99" and "max".
+        """
+        records = self.records()
+        by_status = {}
+        for record in records:
+            by_status[record["status"]] = by_status.get(record["status"], 0) + 1
+        summary = {"count": len(records), "by_status": by_status}
+        for field in SUMMARY_FIELDS:
+            values = [r[field] for r in records if isinstance(r.get(field), (int, float))]
+            if not values:
+                continue
+            summary[field] = {
+                "mean": sum(values) / len(values),
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99),
+                "max": max(values),
+            }
+        return summary
+
+    def export_json(self, path):
+        """Write the summary and every record to a JSON file."""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"summary": self.summary(), "records": self.records()}, f, indent=2)
+
+    def export_csv(self, path):
+        """Write every record to a CSV file, one row per request."""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(self.records())
@@ -0,0 +1,211 @@
+import json
+import os
+import re
+import threading
+import time
+
+import ai_core
+
+
+FAST_MODEL = "llama3.2"
+LARGE_MODEL = "llama3.1:8b"
+# New user turns (with their attachments) longer than this many approximate
+# tokens go to the large model
+LONG_PROMPT_TOKENS = 1500
+# The large model is skipped while its typical time to first token is above
+# this (seconds)...
+LARGE_LATENCY_BUDGET = 5.0
+# ...or while this many requests are already running on it
+LARGE_MAX_INFLIGHT = 1
+# Latency samples older than this are ignored, so a model that was slow is
+# tried again once it has had time to recover (seconds)
+LATENCY_SAMPLE_TTL = 120.0
+# A model that has not been used for this long is assumed unloaded (seconds)
+RESIDENT_SECONDS = 30 * 60
+ROUTING_LOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs", "routing.jsonl")
+
+_CODE_PATTERN = re.compile(
+    r"```|\b(def|class|import|return|function|const|var|public|void|SELECT|FROM)\b|[{};]\s*$"
+    r"|\b(code|bug|error|exception|traceback|compile|regex|python|javascript|sql)\b",
+    re.IGNORECASE | re.MULTILINE,
+)
+_SUMMARY_PATTERN = re.compile(
+    r"\b(summari[sz]e|summary|tl;?dr|key points|condense|outline)\b", re.IGNORECASE
+)
+
+
+def detect_intent(text):
+    """Classify a prompt as "code", "summarize" or "chat"."""
+    if _SUMMARY_PATTERN.search(text):
+        return "summarize"
+    if _CODE_PATTERN.search(text):
+        return "code"
+    return "chat"
+
+
+class ModelRouter:
+    """Picks a model per request from prompt size, intent and measured latency.
+
+    Short chat goes to the fast model; code, summarization and long prompts
+    go to the large model unless it is cold (not loaded) or overloaded, in
+    which case the fast model answers and the large one can be warmed up in
+    the background. Every decision is appended to a JSONL log together with
+    its measured latency so the thresholds can be tuned.
+    """
+
+    def __init__(self, fast_model=FAST_MODEL, large_model=LARGE_MODEL,
+                 long_prompt_tokens=LONG_PROMPT_TOKENS, latency_budget=LARGE_LATENCY_BUDGET,
+                 large_max_inflight=LARGE_MAX_INFLIGHT, resident_seconds=RESIDENT_SECONDS,
+                 log_path=ROUTING_LOG, smoothing=0.3, latency_ttl=LATENCY_SAMPLE_TTL):
+        self.fast_model = fast_model
+        self.large_model = large_model
+        self.long_prompt_tokens = long_prompt_tokens
+        self.latency_budget = latency_budget
+        self.large_max_inflight = large_max_inflight
+        self.resident_seconds = resident_seconds
+        self.log_path = log_path
+        self.smoothing = smoothing
+        self.latency_ttl = latency_ttl
+
+        self.latency = {}      # model -> smoothed time to first token (s)
+        self.latency_at = {}   # model -> time.monotonic() of the last latency sample
+        self.inflight = {}     # model -> running requests
+        self.last_used = {}    # model -> time.monotonic() of the last success
+        self._decisions = {}   # job id -> decision dict
+        self._warming = {}     # warmup job id -> model
+        self._lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # Model state
+    # ------------------------------------------------------------------
+    def is_warm(self, model):
+        last = self.last_used.get(model)
+        return last is not None and time.monotonic() - last < self.resident_seconds
+
+    def is_overloaded(self, model):
+        if self.inflight.get(model, 0) >= self.large_max_inflight:
+            return True
+        measured_at = self.latency_at.get(model)
+        if measured_at is None or time.monotonic() - measured_at > self.latency_ttl:
+            # No recent sample: let a request through to measure it again
+            return False
+        return self.latency[model] > self.latency_budget
+
+    def track_warmup(self, job, model):
+        """Remember which model a warmup job is loading."""
+        with self._lock:
+            self._warming[job.id] = model
+
+    def handle_warmup(self, job_id, load_seconds):
+        """
+        Consume a "warmup" result from the engine.
+
+        Returns:
+            True if the warmup was one of the router's.
+        """
+        with self._lock:
+            model = self._warming.pop(job_id, None)
+            if model is None:
+                return False
+            if load_seconds is not None:
+                self.last_used[model] = time.monotonic()
+            return True
+
+    # ------------------------------------------------------------------
+    # Routing
+    # ------------------------------------------------------------------
+    def choose(self, messages):
+        """
+        Pick the model for a message list whose last message is the new turn.
+
+        Returns:
+            Decision dict with "model", "intent", "prompt_tokens", "reason"
+            and "warm_up" (a model worth loading in the background, or None).
+        """
+        # Only the new turn (attachments are part of it) decides: the history
+        # grows every turn and would end up sending everything to the large model
+        prompt = messages[-1]["content"] if messages else ""
+        prompt_tokens = ai_core.estimate_message_tokens(messages[-1]) if messages else 0
+        intent = detect_intent(prompt)
+
+        with self._lock:
+            wants_large = intent != "chat" or prompt_tokens > self.long_prompt_tokens
+            warm_up = None
+            if not wants_large:
+                model, reason = self.fast_model, "short chat"
+            elif self.large_model == self.fast_model:
+                model, reason = self.fast_model, "single model"
+            elif not self.is_warm(self.large_model):
+                model, reason = self.fast_model, "large model cold"
+                if self.large_model not in self._warming.values():
+                    warm_up = self.large_model
+            elif self.is_overloaded(self.large_model):
+                model, reason = self.fast_model, "large model overloaded"
+            else:
+                model = self.large_model
+                reason = "long prompt" if intent == "chat" else intent
+
+        return {
+            "model": model,
+            "intent": intent,
+            "prompt_tokens": prompt_tokens,
+            "reason": reason,
+            "warm_up": warm_up,
+        }
+
+    def started(self, job, decision):
+        """Record that job is running with decision."""
+        with self._lock:
+            decision = dict(decision, started_at=time.perf_counter(), first_token=None)
+            self._decisions[job.id] = decision
+            model = decision["model"]
+            self.inflight[model] = self.inflight.get(model, 0) + 1
+
+    def first_token(self, job_id):
+        """Record the time to first token of a routed job."""
+        with self._lock:
+            decision = self._decisions.get(job_id)
+            if decision is not None and decision["first_token"] is None:
+                decision["first_token"] = time.perf_counter() - decision["started_at"]
+
+    def finished(self, job_id, status):
+        """Record the outcome of a routed job and log the decision."""
+        with self._lock:
+            decision = self._decisions.pop(job_id, None)
+            if decision is None:
+                return
+            model = decision["model"]
+            self.inflight[model] = max(0, self.inflight.get(model, 0) - 1)
+            latency = time.perf_counter() - decision["started_at"]
+            if status == "success":
+                self.last_used[model] = time.monotonic()
+            ttft = decision["first_token"]
+            if ttft is not None:
+                # Time to first token does not grow with the length of the answer
+                previous = self.latency.get(model)
+                if previous is None or time.monotonic() - self.latency_at[model] > self.latency_ttl:
+                    self.latency[model] = ttft
+                else:
+                    self.latency[model] = previous + self.smoothing * (ttft - previous)
+                self.latency_at[model] = time.monotonic()
+
+        self._log({
+            "time": time.time(),
+            "model": model,
+            "intent": decision["intent"],
+            "prompt_tokens": decision["prompt_tokens"],
+            "reason": decision["reason"],
+            "status": status,
+            "latency": round(latency, 4),
+            "ttft": None if ttft is None else round(ttft, 4),
+        })
+
+    def _log(self, record):
+        if not self.log_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+        except OSError as exc:
+            print(f"Could not write routing log: {exc}")
@@ -1,29 +1,152 @@
 import pygame
 import win32api
 import math
+import os
+from assets import assets as shared_assets
+
+
+# Pet animations: frames per second and whether they loop. Each is read from
+# images/<name>/<name>_sheet.png (a horizontal strip of square frames) or, if
+# there is no sheet, from images/<name>/<name>_1.png, _2.png, ...
+# Animations without frames fall back to idle.
+ANIMATIONS = {
+    "idle": {"fps": 4, "loop": True},
+    "think": {"fps": 8, "loop": True},
+    "talk": {"fps": 10, "loop": True},
+    "drag": {"fps": 8, "loop": True},
+}
+ATLAS_MAX_WIDTH = 2048  # Width of the scaled atlas before frames wrap to a new row
+
+
+def load_frames(assets, name):
+    """Return the unscaled frames of animation name ([] if it has none)."""
+    sheet_path = f"images/{name}/{name}_sheet.png"
+    if os.path.exists(os.path.join(assets.base_dir, sheet_path)):
+        sheet = assets.image(sheet_path)
+        size = sheet.get_height()
+        return [sheet.subsurface((i * size, 0, size, size)) for i in range(sheet.get_width() // size)]
+
+    frames = []
+    while True:
+        path = f"images/{name}/{name}_{len(frames) + 1}.png"
+        if not os.path.exists(os.path.join(assets.base_dir, path)):
+            return frames
+        frames.append(assets.image(path))
+
+
+class AnimationAtlas:
+    """Every animation frame, scaled once and packed into a single surface.
+
+    Frames are packed in rows (shelves) at their original size, then the
+    whole atlas is scaled with nearest-neighbour, so pixel art stays sharp
+    and drawing any frame is one blit of a rect of the atlas.
+    """
+
+    def __init__(self, animations, scale):
+        """
+        Args:
+            animations: Dict of animation name -> list of unscaled frames;
+                names with no frames get the frames of "idle"
+            scale: Integer scale factor of the atlas
+        """
+        self.scale = scale
+        self.frames = {}  # animation name -> list of frame rects in the atlas
+        max_width = max([ATLAS_MAX_WIDTH // scale] +
+                        [frame.get_width() for frames in animations.values() for frame in frames])
+
+        placements = []
+        x = y = row_height = width = 0
+        for name, frames in animations.items():
+            rects = []
+            for frame in frames:
+                frame_width, frame_height = frame.get_size()
+                if x and x + frame_width > max_width:
+                    x, y, row_height = 0, y + row_height, 0
+                placements.append((frame, (x, y)))
+                rects.append(pygame.Rect(x * scale, y * scale, frame_width * scale, frame_height * scale))
+                x += frame_width
+                row_height = max(row_height, frame_height)
+                width = max(width, x)
+            self.frames[name] = rects
+        for name in animations:
+            if not self.frames[name]:
+                self.frames[name] = self.frames["idle"]
+
+        sheet = pygame.Surface((max(1, width), max(1, y + row_height)), pygame.SRCALPHA)
+        for frame, position in placements:
+            # Adding onto the transparent sheet copies the pixels, alpha included
+            sheet.blit(frame, position, special_flags=pygame.BLEND_RGBA_ADD)
+        self.surface = pygame.transform.scale(
+            sheet, (sheet.get_width() * scale, sheet.get_height() * scale)).convert_alpha()
+
+
+class PetAnimator:
+    """Time-based state machine choosing the pet's animation frame.
+
+    The state follows what the pet is doing: "drag" while it is dragged,
+    "talk" while a reply streams in, "think" while waiting for the model and
+    "idle" otherwise. Each animation restarts when its state is entered.
+    """
+
+    def __init__(self, atlas):
+        self.atlas = atlas
+        self.state = "idle"
+        self.state_started = 0
+
+    def update(self, now, loading=False, streaming=False, dragging=False):
+        """
+        Switch state for the current activity.
+
+        Args:
+            now: Current time in milliseconds
+            loading: True while a model request is in flight
+            streaming: True once its reply has started arriving
+            dragging: True while the pet is being dragged
+        """
+        if dragging:
+            state = "drag"
+        elif streaming:
+            state = "talk"
+        elif loading:
+            state = "think"
+        else:
+            state = "idle"
+        if state != self.state:
+            self.state = state
+            self.state_started = now
+
+    def frame_rect(self, now):
+        """Atlas rect of the frame to show at time now (milliseconds)."""
+        rects = self.atlas.frames[self.state]
+        spec = ANIMATIONS[self.state]
+        index = int((now - self.state_started) * spec["fps"] / 1000)
+        if spec["loop"]:
+            return rects[index % len(rects)]
+        return rects[min(index, len(rects) - 1)]
 
 
 class PetAvatar:
     """Handles pet avatar rendering with body, eyes, and smooth eye tracking."""
     
-    def __init__(self, pixel_art_scale=3):
+    def __init__(self, pixel_art_scale=3, assets=None):
         """
         Initialize the pet avatar.
         
         Args:
             pixel_art_scale: Scale factor for pixel art images (default 3)
+            assets: AssetManager the images come from (the shared one if None)
         """
         self.pixel_art_scale = pixel_art_scale
+        self.assets = assets if assets is not None else shared_assets
         
         # Load pet body image
-        pet_image_original = pygame.image.load("images/idle/idle_1.png").convert_alpha()
-        new_width = pet_image_original.get_width() * pixel_art_scale
-        new_height = pet_image_original.get_height() * pixel_art_scale
-        self.pet_image = pygame.transform.scale(pet_image_original, (new_width, new_height))
+        self.pet_image = self.assets.image("images/idle/idle_1.png", pixel_art_scale)
         self.pet_radius = max(self.pet_image.get_width(), self.pet_image.get_height()) // 2
-        
-        # Load eye image
-        self.eye_image_original = pygame.image.load("images/eyes/eye_1.png").convert_alpha()
+
+        # Body animations, pre-scaled into one atlas
+        animations = {name: load_frames(self.assets, name) for name in ANIMATIONS}
+        self.atlas = AnimationAtlas(animations, pixel_art_scale)
+        self.animator = PetAnimator(self.atlas)
         
         # Eye state for smooth movement
         self.eye_mode = 1
@@ -35,6 +158,10 @@ class PetAvatar:
         self.eye_tracking_enabled = True  # Enable/disable eye tracking
         
     
+    def update_animation(self, now, loading=False, streaming=False, dragging=False):
+        """Pick the body animation for the current activity (see PetAnimator.update)."""
+        self.animator.update(now, loading, streaming, dragging)
+
     def set_eye_smoothness(self, smoothness):
         """Set how smoothly the eyes move (0.05-0.2 recommended)."""
         self.eye_smoothness = smoothness
@@ -63,9 +190,7 @@ class PetAvatar:
         else:
             scale = self.pixel_art_scale
         
-        eye_width = int(self.eye_image_original.get_width() * scale)
-        eye_height = int(self.eye_image_original.get_height() * scale)
-        self.eye_image = pygame.transform.scale(self.eye_image_original, (eye_width, eye_height))
+        self.eye_image = self.assets.image("images/eyes/eye_1.png", scale)
 
     def set_eye_mode(self, mode):
         """Set eye mode to 1 or 2 eyes (default offsets for 2 eyes)."""
@@ -120,7 +245,7 @@ class PetAvatar:
         eye_rect = self.eye_image.get_rect(
             center=(int(eye_center_x + current_offset_x), int(eye_center_y + current_offset_y))
         )
-        screen.blit(self.eye_image, eye_rect)
+        return screen.blit(self.eye_image, eye_rect)
     
     def draw(self, screen, x, y):
         """
@@ -130,18 +255,24 @@ class PetAvatar:
             screen: pygame screen surface
             x: x position of pet center
             y: y position of pet center
+
+        Returns:
+            The rect covering everything that was drawn.
         """
-        # Draw the pet body
-        pet_rect = self.pet_image.get_rect(center=(int(x), int(y)))
+        # Draw the current animation frame of the pet body
+        frame_rect = self.animator.frame_rect(pygame.time.get_ticks())
+        pet_rect = frame_rect.copy()
+        pet_rect.center = (int(x), int(y))
         pygame.draw.rect(screen, (0, 0, 0), pet_rect.inflate(-8, -8))
-        screen.blit(self.pet_image, pet_rect)
+        drawn_rect = screen.blit(self.atlas.surface, pet_rect, frame_rect)
         
         # Draw eyes that follow mouse
         cursor_pos = win32api.GetCursorPos()
         cursor_x, cursor_y = cursor_pos[0], cursor_pos[1]
 
         for eye_index in range(len(self.eye_positions)):
-            self._draw_eye(screen, x, y, cursor_x, cursor_y, eye_index)
+            drawn_rect.union_ip(self._draw_eye(screen, x, y, cursor_x, cursor_y, eye_index))
+        return drawn_rect
     
     
     
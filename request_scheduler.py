@@ -0,0 +1,150 @@
+import heapq
+import itertools
+import time
+
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+
+class RequestScheduler:
+    """Queues prompts in front of the AI engine instead of dropping them.
+
+    Prompts wait in a bounded priority queue (FIFO within a priority) and are
+    started one at a time through start_request. Duplicate submissions are
+    coalesced, and a preempting submission cancels the reply in progress.
+    Everything here runs on the UI thread; only the started jobs run elsewhere.
+    """
+
+    def __init__(self, start_request, max_pending=8, max_inflight=1):
+        """
+        Args:
+            start_request: Callable taking the prompt text and returning a job
+                handle with an ``id`` attribute and a ``cancel()`` method
+            max_pending: Maximum number of prompts waiting to be started
+            max_inflight: Maximum number of prompts being answered at once
+        """
+        self.start_request = start_request
+        self.max_pending = max_pending
+        self.max_inflight = max_inflight
+
+        self._pending = []      # heap of (priority, seq, text, enqueued_at)
+        self._inflight = {}     # job id -> (job, text)
+        self._seq = itertools.count()
+
+        # Counters
+        self.submitted = 0
+        self.started = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.preempted = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.last_wait = 0.0  # wait of the prompt being started, readable in start_request
+
+    @staticmethod
+    def _normalize(text):
+        return " ".join(text.split()).lower()
+
+    @property
+    def queue_depth(self):
+        """Number of prompts waiting to be started."""
+        return len(self._pending)
+
+    @property
+    def inflight_count(self):
+        """Number of prompts currently being answered."""
+        return len(self._inflight)
+
+    @property
+    def busy(self):
+        return bool(self._pending or self._inflight)
+
+    def is_active(self, job_id):
+        """True if results for job_id should still be shown."""
+        return job_id in self._inflight
+
+    def submit(self, text, priority=PRIORITY_NORMAL, preempt=False):
+        """
+        Queue a prompt.
+
+        Args:
+            text: Prompt text
+            priority: PRIORITY_HIGH, PRIORITY_NORMAL or PRIORITY_LOW
+            preempt: Cancel the reply in progress and start this prompt next
+
+        Returns:
+            True if the prompt was queued (or coalesced with an identical
+            one), False if the queue was full.
+        """
+        key = self._normalize(text)
+        waiting = [self._normalize(item[2]) for item in self._pending]
+        running = [self._normalize(t) for _, t in self._inflight.values()]
+        if key in waiting or key in running:
+            self.coalesced += 1
+            return True
+
+        if preempt:
+            priority = PRIORITY_HIGH
+        elif len(self._pending) >= self.max_pending:
+            self.rejected += 1
+            return False
+
+        self.submitted += 1
+        heapq.heappush(self._pending, (priority, next(self._seq), text, time.perf_counter()))
+        # A preempting prompt may push the queue one over its bound
+        if len(self._pending) > self.max_pending:
+            self._drop_lowest()
+
+        if preempt and self._inflight:
+            self.preempted += 1
+            self.cancel_inflight()
+        return True
+
+    def _drop_lowest(self):
+        """Remove the newest prompt of the lowest priority."""
+        victim = max(self._pending, key=lambda item: (item[0], item[1]))
+        self._pending.remove(victim)
+        heapq.heapify(self._pending)
+        self.rejected += 1
+
+    def pump(self):
+        """Start queued prompts while there is room. Call once per frame."""
+        while self._pending and len(self._inflight) < self.max_inflight:
+            _, _, text, enqueued_at = heapq.heappop(self._pending)
+            wait = time.perf_counter() - enqueued_at
+            self.last_wait = wait
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            self.started += 1
+
+            job = self.start_request(text)
+            self._inflight[job.id] = (job, text)
+
+    def finish(self, job_id):
+        """Mark a job as done (success, error or cancelled)."""
+        self._inflight.pop(job_id, None)
+
+    def cancel_inflight(self):
+        """Cancel every reply in progress; each job still reports "cancelled"."""
+        for job, _ in list(self._inflight.values()):
+            job.cancel()
+
+    def clear_pending(self):
+        """Drop all prompts that have not been started yet."""
+        self._pending = []
+
+    def stats(self):
+        """Return the scheduler counters as a dict."""
+        return {
+            "submitted": self.submitted,
+            "started": self.started,
+            "coalesced": self.coalesced,
+            "rejected": self.rejected,
+            "preempted": self.preempted,
+            "queue_depth": self.queue_depth,
+            "inflight": self.inflight_count,
+            "avg_wait": self.total_wait / self.started if self.started else 0.0,
+            "max_wait": self.max_wait,
+        }
@@ -0,0 +1,228 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """Two-tier cache for model replies to identical prompts.
+
+    Replies are keyed on (model name, normalized message list, generation
+    options). The first tier is an in-memory LRU; the second tier is a
+    directory of small JSON files that survives restarts and is kept in
+    check by a TTL and a total size limit. The directory is scanned once;
+    after that the size and recency of every file are tracked in memory, and
+    when the limit is exceeded files are evicted down to a low-water mark so
+    the next writes do not have to evict again.
+    """
+
+    def __init__(self, cache_dir, max_memory_entries=256, max_disk_bytes=20 * 1024 * 1024,
+                 ttl_seconds=7 * 24 * 3600, disk_low_water=0.9):
+        """
+        Args:
+            cache_dir: Directory for the on-disk tier (None to disable it)
+            max_memory_entries: Number of replies kept in the in-memory LRU
+            max_disk_bytes: Size limit of the on-disk tier; oldest files go first
+            ttl_seconds: Entries older than this are treated as misses and removed
+            disk_low_water: Fraction of max_disk_bytes eviction trims the tier to
+        """
+        self.cache_dir = cache_dir
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl_seconds = ttl_seconds
+        self.disk_low_water = disk_low_water
+
+        self._memory = OrderedDict()  # key -> (created_at, reply)
+        self._lock = threading.Lock()
+        # path -> (size, last use), least recently used first; built lazily
+        # on first write
+        self._disk_index = None
+        self._disk_bytes = 0
+
+        # Counters
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(model_name, messages, options=None):
+        """Build a stable cache key for a request."""
+        normalized = [
+            [m.get("role", ""), " ".join(str(m.get("content", "")).split())]
+            for m in messages
+        ]
+        payload = json.dumps(
+            {"model": model_name, "messages": normalized, "options": options or {}},
+            sort_keys=True,
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path_for(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".json")
+
+    def _is_expired(self, created_at):
+        return self.ttl_seconds is not None and time.time() - created_at > self.ttl_seconds
+
+    def get(self, key):
+        """Return the cached reply for key, or None on a miss."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, reply = entry
+                if not self._is_expired(created_at):
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return reply
+                del self._memory[key]
+
+            reply = self._read_disk(key)
+            if reply is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            return reply
+
+    def put(self, key, reply):
+        """Store a reply in both tiers."""
+        if not reply:
+            return
+        created_at = time.time()
+        with self._lock:
+            self._remember(key, created_at, reply)
+            self._write_disk(key, created_at, reply)
+            self.stores += 1
+
+    def clear(self):
+        """Remove every entry from both tiers."""
+        with self._lock:
+            self._memory.clear()
+            for path, _, _ in self._scan_disk():
+                self._remove_file(path)
+            self._disk_index = OrderedDict()
+            self._disk_bytes = 0
+
+    def stats(self):
+        """Return the hit/miss counters and current sizes as a dict."""
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "memory_entries": len(self._memory),
+                "disk_bytes": self._disk_bytes,
+            }
+
+    # ------------------------------------------------------------------
+    # Internal helpers (called with the lock held)
+    # ------------------------------------------------------------------
+    def _remember(self, key, created_at, reply):
+        self._memory[key] = (created_at, reply)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _read_disk(self, key):
+        if not self.cache_dir:
+            return None
+        path = self._path_for(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if self._is_expired(entry.get("created_at", 0)):
+            self._remove_file(path)
+            return None
+
+        # Touch the file so size-based eviction treats it as recently used,
+        # also after a restart
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        if self._disk_index is not None and path in self._disk_index:
+            self._disk_index[path] = (self._disk_index[path][0], time.time())
+            self._disk_index.move_to_end(path)
+        reply = entry.get("reply")
+        if reply:
+            self._remember(key, entry["created_at"], reply)
+        return reply
+
+    def _write_disk(self, key, created_at, reply):
+        if not self.cache_dir:
+            return
+        path = self._path_for(key)
+        data = json.dumps({"created_at": created_at, "reply": reply}, ensure_ascii=False)
+        if self._disk_index is None:
+            self._load_disk_index()
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as exc:
+            print(f"Response cache write failed: {exc}", file=sys.stderr)
+            return
+
+        old_size, _ = self._disk_index.pop(path, (0, None))
+        size = len(data.encode("utf-8"))
+        self._disk_index[path] = (size, time.time())
+        self._disk_bytes += size - old_size
+
+        if self._disk_bytes > self.max_disk_bytes:
+            self._evict_disk()
+
+    def _load_disk_index(self):
+        self._disk_index = OrderedDict(
+            (path, (size, mtime))
+            for path, size, mtime in sorted(self._scan_disk(), key=lambda item: item[2])
+        )
+        self._disk_bytes = sum(size for size, _ in self._disk_index.values())
+
+    def _scan_disk(self):
+        """Yield (path, size, mtime) for every cache file."""
+        if not self.cache_dir or not os.path.isdir(self.cache_dir):
+            return
+        for bucket in os.scandir(self.cache_dir):
+            if not bucket.is_dir():
+                continue
+            for entry in os.scandir(bucket.path):
+                if entry.name.endswith(".json"):
+                    try:
+                        info = entry.stat()
+                    except OSError:
+                        continue
+                    yield entry.path, info.st_size, info.st_mtime
+
+    def _evict_disk(self):
+        """Drop expired files, then least recently used ones down to the low-water mark."""
+        target = self.max_disk_bytes * self.disk_low_water
+        now = time.time()
+        while self._disk_index:
+            path, (size, used_at) = next(iter(self._disk_index.items()))
+            expired = self.ttl_seconds is not None and now - used_at > self.ttl_seconds
+            if not expired and self._disk_bytes <= target:
+                break
+            self._remove_file(path)
+
+    def _remove_file(self, path):
+        try:
+            os.remove(path)
+            self.evictions += 1
+        except OSError:
+            pass
+        if self._disk_index is not None and path in self._disk_index:
+            size, _ = self._disk_index.pop(path)
+            self._disk_bytes -= size
@@ -0,0 +1,133 @@
+import threading
+import time
+
+import httpx
+import pytest
+
+import ai_core
+from circuit_breaker import CLOSED, OPEN, CircuitBreaker
+from fake_ollama_server import FakeOllamaServer
+
+
+MESSAGES = [{"role": "user", "content": "hello"}]
+
+
+@pytest.fixture
+def server():
+    with FakeOllamaServer(tokens=3, first_token_delay=0.0, token_delay=0.0) as fake:
+        yield fake
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(ai_core, "RETRY_BASE_DELAY", 0.05)
+    monkeypatch.setattr(ai_core, "RETRY_MAX_DELAY", 0.1)
+
+
+def make_breaker(server, failure_threshold=3):
+    def probe():
+        return httpx.get(server.url + "/api/version", timeout=1.0).status_code == 200
+
+    return CircuitBreaker(failure_threshold=failure_threshold, probe=probe,
+                          probe_interval=0.05, probe_max_interval=0.1, name="fake server")
+
+
+def chat(client, breaker, attempts=1):
+    return ai_core.call_with_retry(
+        lambda: client.chat(model="llama3.2", messages=MESSAGES), attempts=attempts, breaker=breaker
+    )
+
+
+def wait_for(condition, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_fails_fast_once_the_circuit_opens(server):
+    client = ai_core.create_client(server.url)
+    breaker = make_breaker(server)
+    server.set_down(True)
+
+    for _ in range(3):
+        with pytest.raises(Exception) as info:
+            chat(client, breaker)
+        assert ai_core.is_transient_error(info.value)
+    assert breaker.state == OPEN
+
+    rejected = server.rejected_count
+    start = time.perf_counter()
+    for _ in range(20):
+        with pytest.raises(ai_core.BackendUnavailable):
+            chat(client, breaker)
+    assert time.perf_counter() - start < 0.1
+    # Short-circuited requests never reach the server (the probe may, though)
+    assert breaker.short_circuited == 20
+    assert server.rejected_count - rejected <= 5
+
+
+def test_probe_closes_the_circuit_after_recovery(server):
+    client = ai_core.create_client(server.url)
+    breaker = make_breaker(server, failure_threshold=1)
+    server.set_down(True)
+    with pytest.raises(Exception):
+        chat(client, breaker)
+    assert breaker.is_open
+
+    time.sleep(0.2)
+    assert breaker.is_open  # still down: the probes keep failing
+    server.set_down(False)
+    assert wait_for(lambda: breaker.state == CLOSED)
+    assert chat(client, breaker)["message"]["content"]
+
+
+def test_transient_errors_are_retried(server):
+    client = ai_core.create_client(server.url)
+    breaker = make_breaker(server, failure_threshold=10)
+    server.set_down(True)
+    threading.Timer(0.15, server.set_down, args=(False,)).start()
+
+    response = chat(client, breaker, attempts=8)
+    assert response["message"]["content"]
+    assert server.rejected_count >= 1
+    assert breaker.state == CLOSED
+
+
+def test_rides_out_a_flapping_server():
+    with FakeOllamaServer(tokens=3, first_token_delay=0.0, token_delay=0.0,
+                          flap_interval=0.3) as server:
+        client = ai_core.create_client(server.url)
+        breaker = make_breaker(server, failure_threshold=2)
+        outcomes = []
+        deadline = time.monotonic() + 1.5
+        while time.monotonic() < deadline:
+            try:
+                chat(client, breaker, attempts=2)
+                outcomes.append("ok")
+            except ai_core.BackendUnavailable:
+                outcomes.append("short-circuited")
+            except Exception as exc:
+                assert ai_core.is_transient_error(exc)
+                outcomes.append("failed")
+            time.sleep(0.01)
+
+    assert breaker.times_opened >= 1
+    # Requests succeed again after the circuit has been open
+    first_open = outcomes.index("short-circuited")
+    assert "ok" in outcomes[first_open:]
+
+
+def test_read_timeouts_count_as_failures_but_are_not_retried():
+    with FakeOllamaServer(tokens=3, first_token_delay=0.5, token_delay=0.0) as server:
+        client = ai_core.create_client(server.url, read_timeout=0.1)
+        breaker = make_breaker(server, failure_threshold=10)
+        start = time.perf_counter()
+        with pytest.raises(httpx.ReadTimeout):
+            chat(client, breaker, attempts=3)
+        elapsed = time.perf_counter() - start
+
+    assert elapsed < 0.3
+    assert breaker.stats()["failures"] == 1
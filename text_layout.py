@@ -0,0 +1,295 @@
+import bisect
+from collections import OrderedDict
+
+
+# Number of strings whose prefix widths are kept by prefix_widths()
+PREFIX_CACHE_SIZE = 64
+# Memory budget of a TextSurfaceCache
+SURFACE_CACHE_BYTES = 4 * 1024 * 1024
+
+_prefix_cache = OrderedDict()  # (font, text) -> PrefixWidths
+
+
+class PrefixWidths:
+    """Cumulative advance widths of a string, for caret and selection hit-testing.
+
+    widths[i] is font.size(text[:i]), kerning included, so carets and
+    selections line up with the rendered text. The table is built once per
+    string; positions and indices are then looked up without measuring.
+    """
+
+    def __init__(self, font, text):
+        self.text = text
+        self.widths = [0] + [font.size(text[:i])[0] for i in range(1, len(text) + 1)]
+
+    @property
+    def total(self):
+        return self.widths[-1]
+
+    def x_of(self, index):
+        """Width of the text before index (clamped to the text)."""
+        return self.widths[max(0, min(index, len(self.text)))]
+
+    def span(self, start, end):
+        """Width of text[start:end]."""
+        return self.x_of(end) - self.x_of(start)
+
+    def index_at(self, x):
+        """Caret index closest to x pixels from the start of the text."""
+        widths = self.widths
+        index = bisect.bisect_left(widths, x)
+        if index >= len(widths):
+            return len(self.text)
+        if index > 0 and x - widths[index - 1] < widths[index] - x:
+            return index - 1
+        return index
+
+
+def prefix_widths(font, text):
+    """Return the PrefixWidths of text, reusing it while the text is unchanged."""
+    key = (font, text)
+    widths = _prefix_cache.get(key)
+    if widths is None:
+        widths = _prefix_cache[key] = PrefixWidths(font, text)
+        if len(_prefix_cache) > PREFIX_CACHE_SIZE:
+            _prefix_cache.popitem(last=False)
+    else:
+        _prefix_cache.move_to_end(key)
+    return widths
+
+
+class TextSurfaceCache:
+    """LRU cache of rendered text, capped by the memory its surfaces use.
+
+    render() has the arguments of font.render() and returns the cached
+    surface for the same (text, font, color, antialias), so callers must
+    not draw on it. Surfaces larger than the whole budget are not kept.
+    """
+
+    def __init__(self, max_bytes=SURFACE_CACHE_BYTES):
+        """
+        Args:
+            max_bytes: Approximate memory cap of the cached surfaces
+        """
+        self.max_bytes = max_bytes
+        self._surfaces = OrderedDict()  # key -> (surface, size in bytes)
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+
+    def __len__(self):
+        return len(self._surfaces)
+
+    def render(self, font, text, antialias, color):
+        """Rendered surface of text, rendered only on a cache miss."""
+        key = (text, font, color, antialias)
+        entry = self._surfaces.get(key)
+        if entry is not None:
+            self._surfaces.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+        surface = font.render(text, antialias, color)
+        size = surface.get_pitch() * surface.get_height()
+        if size <= self.max_bytes:
+            self._surfaces[key] = (surface, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self._surfaces.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+        return surface
+
+    def clear(self):
+        self._surfaces.clear()
+        self.bytes = 0
+
+    def stats(self):
+        """Return the cache counters as a dict."""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._surfaces),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+class TextLayout:
+    """Word-wrapped layout of a text for one font and width, kept up to date.
+
+    Lines are slices of the text: lines[i] starts at character line_starts[i].
+    Paragraphs are split on newlines and wrapped on spaces; words wider than
+    the width are broken into chunks. set_text() does nothing when the text
+    is unchanged, and when text was only appended (a streaming reply) it
+    re-wraps from the last line onward instead of from the beginning.
+    Prefix widths are kept until their line is re-wrapped; rendered lines
+    come from a TextSurfaceCache.
+    """
+
+    def __init__(self, font, width, color=(0, 0, 0), surface_cache=None):
+        """
+        Args:
+            font: pygame font used to measure and render the lines
+            width: Maximum line width in pixels
+            color: Text color of rendered lines
+            surface_cache: TextSurfaceCache for the rendered lines (created if None)
+        """
+        self.font = font
+        self.width = width
+        self.color = color
+        self.surface_cache = surface_cache if surface_cache is not None else TextSurfaceCache()
+        self.line_height = font.get_linesize()
+
+        self.text = ""
+        self.lines = []
+        self.line_starts = []
+        # Index wrapping can restart from to rebuild each line: its own start,
+        # or the start of the word for the chunks of a word that was broken up
+        self._resume = []
+        self._widths = []
+
+        # Counters
+        self.full_layouts = 0
+        self.incremental_layouts = 0
+        self.unchanged = 0
+        self.lines_wrapped = 0
+
+        self._wrap(0)
+
+    def __len__(self):
+        return len(self.lines)
+
+    @property
+    def height(self):
+        return len(self.lines) * self.line_height
+
+    def set_text(self, text):
+        """Lay out text, reusing as much of the previous layout as possible."""
+        if text is self.text or text == self.text:
+            self.unchanged += 1
+            return
+        if self.text and text.startswith(self.text):
+            # Appending can only make the last word longer, so every line
+            # before the last one wraps exactly as it did
+            resume = self._resume[-1]
+            first = bisect.bisect_left(self.line_starts, resume)
+            self.incremental_layouts += 1
+        else:
+            resume = first = 0
+            self.full_layouts += 1
+        del self.lines[first:]
+        del self.line_starts[first:]
+        del self._resume[first:]
+        del self._widths[first:]
+        self.text = text
+        self._wrap(resume)
+
+    def line_end(self, index):
+        """Character index just past line index (its newline or break included)."""
+        if index + 1 < len(self.line_starts):
+            return self.line_starts[index + 1]
+        return len(self.text)
+
+    def line_at(self, y):
+        """Index of the line at y pixels from the top (may be out of range)."""
+        return int(y // self.line_height)
+
+    def visible_range(self, scroll_offset, view_height):
+        """Range of the line indices that intersect a view of view_height pixels."""
+        first = max(0, int(scroll_offset // self.line_height))
+        last = min(len(self.lines), -(-int(scroll_offset + view_height) // self.line_height))
+        return range(first, max(first, last))
+
+    def surface(self, index):
+        """Rendered surface of line index."""
+        return self.surface_cache.render(self.font, self.lines[index], True, self.color)
+
+    def prefix_widths(self, index):
+        """PrefixWidths of line index, built on first use."""
+        widths = self._widths[index]
+        if widths is None:
+            widths = self._widths[index] = PrefixWidths(self.font, self.lines[index])
+        return widths
+
+    def index_at(self, x, y):
+        """Character index of the text closest to the point (x, y) of the layout."""
+        line = self.line_at(y)
+        if line < 0:
+            return 0
+        if line >= len(self.lines):
+            return len(self.text)
+        widths = self.prefix_widths(line)
+        if x >= widths.total:
+            # Past the end of the line: include the space or newline it broke at
+            return self.line_end(line)
+        return self.line_starts[line] + widths.index_at(x)
+
+    def stats(self):
+        """Return the layout counters as a dict."""
+        return {
+            "lines": len(self.lines),
+            "full_layouts": self.full_layouts,
+            "incremental_layouts": self.incremental_layouts,
+            "unchanged": self.unchanged,
+            "lines_wrapped": self.lines_wrapped,
+        }
+
+    # ------------------------------------------------------------------
+    # Wrapping
+    # ------------------------------------------------------------------
+    def _fits(self, start, end):
+        return self.font.size(self.text[start:end])[0] <= self.width
+
+    def _add_line(self, start, end, resume):
+        self.lines.append(self.text[start:end])
+        self.line_starts.append(start)
+        self._resume.append(resume)
+        self._widths.append(None)
+        self.lines_wrapped += 1
+
+    def _wrap(self, pos):
+        """Wrap the text from pos, which must be the start of a line, to its end."""
+        text = self.text
+        while True:
+            newline = text.find("\n", pos)
+            end = len(text) if newline < 0 else newline
+            self._wrap_paragraph(pos, end)
+            if newline < 0:
+                return
+            pos = newline + 1
+
+    def _wrap_paragraph(self, pos, end):
+        line_start = None  # Start of the open line, None between lines
+        line_end = pos
+        for word in self.text[pos:end].split(" "):
+            word_end = pos + len(word)
+            if line_start is not None and not self._fits(line_start, word_end):
+                self._add_line(line_start, line_end, line_start)
+                line_start = None
+            if line_start is None:
+                if self._fits(pos, word_end):
+                    line_start = pos
+                else:
+                    self._add_chunks(pos, word_end)
+            if line_start is not None:
+                line_end = word_end
+            pos = word_end + 1
+        if line_start is not None:
+            self._add_line(line_start, line_end, line_start)
+
+    def _add_chunks(self, start, end):
+        """Break the word text[start:end] into lines that each fit."""
+        chunk_start = start
+        for pos in range(start + 1, end):
+            if not self._fits(chunk_start, pos + 1):
+                self._add_line(chunk_start, pos, start)
+                chunk_start = pos
+        self._add_line(chunk_start, end, start)
@@ -1,17 +1,131 @@
 import pygame
 import math
 from pet_avatar import PetAvatar
+from text_layout import TextLayout, TextSurfaceCache, prefix_widths
+
+
+# Typing indicator geometry and animation
+TYPING_BUBBLE_WIDTH = 70
+TYPING_BUBBLE_HEIGHT = 40
+TYPING_TAIL_SIZE = 12
+TYPING_DOT_SPEED = 0.008  # radians of the dot wave per ms
+TYPING_FRAMES = 32        # precomputed frames per wave period
+
+
+class FramePresenter:
+    """Clears and presents only the parts of the screen that changed.
+
+    Every draw call reports the rect it touched with add(). clear() wipes
+    the rects drawn in the previous frame, and present() pushes the union of
+    the previous and current rects to the display instead of the whole
+    screen. Pixel counters show how much presentation work that saves.
+    """
+
+    def __init__(self, screen, background):
+        """
+        Args:
+            screen: The display surface
+            background: Color the screen is cleared to (the transparent color key)
+        """
+        self.screen = screen
+        self.background = background
+        self.screen_rect = screen.get_rect()
+        self._previous = []
+        self._current = []
+        self._full_redraw = True
+
+        # Counters
+        self.frames = 0
+        self.pixels_presented = 0
+        self.update_calls = 0
+
+    def invalidate(self):
+        """Redraw and present the whole screen on the next frame."""
+        self._full_redraw = True
+
+    def clear(self):
+        """Erase what the previous frame drew. Call before drawing."""
+        if self._full_redraw:
+            self.screen.fill(self.background)
+        else:
+            for rect in self._previous:
+                self.screen.fill(self.background, rect)
+        self._current = []
+
+    def add(self, rect):
+        """Record a rect drawn this frame (None is ignored)."""
+        if rect:
+            rect = self.screen_rect.clip(rect)
+            if rect.width and rect.height:
+                self._current.append(rect)
+
+    @staticmethod
+    def _merge(rects):
+        """Union rects that overlap so each screen area is presented once."""
+        merged = []
+        for rect in rects:
+            rect = rect.copy()
+            i = 0
+            while i < len(merged):
+                if rect.colliderect(merged[i]):
+                    rect.union_ip(merged.pop(i))
+                    i = 0
+                else:
+                    i += 1
+            merged.append(rect)
+        return merged
+
+    def present(self):
+        """Push this frame's changes to the display."""
+        if self._full_redraw:
+            dirty = [self.screen_rect]
+            self._full_redraw = False
+        else:
+            dirty = self._merge(self._previous + self._current)
+        if dirty:
+            pygame.display.update(dirty)
+            self.update_calls += 1
+        self._previous = self._merge(self._current)
+
+        self.frames += 1
+        self.pixels_presented += sum(r.width * r.height for r in dirty)
+
+    def stats(self):
+        """Return the frame-cost counters as a dict."""
+        full_pixels = self.screen_rect.width * self.screen_rect.height
+        average = self.pixels_presented / self.frames if self.frames else 0.0
+        return {
+            "frames": self.frames,
+            "avg_pixels_per_frame": round(average),
+            "full_screen_pixels": full_pixels,
+            "fraction_of_full_screen": round(average / full_pixels, 4) if full_pixels else 0.0,
+            "update_calls": self.update_calls,
+        }
+
 
 class UI:
     """Handles UI rendering including hover effects, menus, and typing indicator."""
 
-    def __init__(self, font_name="Segoe UI"):
-        self.pet_avatar = PetAvatar()
+    def __init__(self, font_name="Segoe UI", pet_avatar=None):
+        """
+        Args:
+            font_name: Name of the UI font
+            pet_avatar: The PetAvatar being drawn (a new one if None); its
+                image and radius position the widgets around the pet
+        """
+        self.pet_avatar = pet_avatar if pet_avatar is not None else PetAvatar()
         self.pet_radius = self.pet_avatar.pet_radius
         self.font_name = font_name
+        # Rendered text shared by the reply box and the input field
+        self.text_cache = TextSurfaceCache()
+        # Prebuilt widget layers, rebuilt only when their size or theme changes
+        self._menu_key = None
+        self._menu_layers = {}  # hovered button (None, 0 or 1) -> menu surface
+        self._typing_strip = None
 
         # Text box selection state
         self.text_box_text = ""
+        self.text_box_layout = None
         self.text_box_lines = []
         self.text_box_line_start_indices = []
         self.text_box_font = None
@@ -23,49 +137,72 @@ class UI:
         self.text_box_selecting = False
 
     def draw_hover_glow(self, screen, x, y):
-        """Draw a white glow around the pet when hovering."""
+        """Draw a white glow around the pet when hovering. Returns the drawn rect."""
         pet_rect = self.pet_avatar.pet_image.get_rect(center=(int(x), int(y)))
-        pygame.draw.rect(screen, (255, 255, 255), pet_rect.inflate(4, 4))
+        return pygame.draw.rect(screen, (255, 255, 255), pet_rect.inflate(4, 4))
 
     def draw_menu(self, screen, input_handler, mouse_pos, menu_width, menu_full_height,
                   button_height, color_bg, color_accent, color_text, color_hover, font):
+        """Draw the context menu. Returns the drawn rect, or None when it is closed."""
         if not input_handler.menu_open or input_handler.menu_anim_height < 2:
-            return
+            return None
 
-        full_menu_surf = pygame.Surface((menu_width, menu_full_height), pygame.SRCALPHA)
-        pygame.draw.rect(full_menu_surf, color_bg, (0, 0, menu_width, menu_full_height), border_radius=8)
+        hovered = None
+        for button in (0, 1):
+            if input_handler.is_mouse_over_menu_button(mouse_pos, button, button_height):
+                hovered = button
+        full_menu_surf = self._menu_layer(hovered, input_handler.is_opening_left, menu_width,
+                                          menu_full_height, button_height, color_bg, color_accent,
+                                          color_text, color_hover, font)
 
-        if input_handler.is_opening_left:
-            pygame.draw.rect(full_menu_surf, color_accent, (menu_width - 4, 0, 4, menu_full_height),
+        src_rect = pygame.Rect(0, menu_full_height - int(input_handler.menu_anim_height),
+                               menu_width, int(input_handler.menu_anim_height))
+        current_menu_x, current_menu_y = input_handler.get_menu_render_position()
+        return screen.blit(full_menu_surf, (current_menu_x, current_menu_y), src_rect)
+
+    def _menu_layer(self, hovered, opening_left, menu_width, menu_full_height, button_height,
+                    color_bg, color_accent, color_text, color_hover, font):
+        """Return the fully opened menu with button hovered highlighted, built once."""
+        key = (opening_left, menu_width, menu_full_height, button_height,
+               color_bg, color_accent, color_text, color_hover, font)
+        if key != self._menu_key:
+            self._menu_key = key
+            self._menu_layers = {}
+        layer = self._menu_layers.get(hovered)
+        if layer is not None:
+            return layer
+
+        layer = pygame.Surface((menu_width, menu_full_height), pygame.SRCALPHA)
+        pygame.draw.rect(layer, color_bg, (0, 0, menu_width, menu_full_height), border_radius=8)
+
+        if opening_left:
+            pygame.draw.rect(layer, color_accent, (menu_width - 4, 0, 4, menu_full_height),
                              border_top_right_radius=8, border_bottom_right_radius=8)
         else:
-            pygame.draw.rect(full_menu_surf, color_accent, (0, 0, 4, menu_full_height),
+            pygame.draw.rect(layer, color_accent, (0, 0, 4, menu_full_height),
                              border_top_left_radius=8, border_bottom_left_radius=8)
 
-        if input_handler.is_mouse_over_menu_button(mouse_pos, 0, button_height):
-            pygame.draw.rect(full_menu_surf, color_hover, (0, 0, menu_width, button_height),
+        if hovered == 0:
+            pygame.draw.rect(layer, color_hover, (0, 0, menu_width, button_height),
                              border_top_left_radius=8, border_top_right_radius=8)
-
-        if input_handler.is_mouse_over_menu_button(mouse_pos, 1, button_height):
-            pygame.draw.rect(full_menu_surf, color_hover, (0, button_height, menu_width, button_height),
+        elif hovered == 1:
+            pygame.draw.rect(layer, color_hover, (0, button_height, menu_width, button_height),
                              border_bottom_left_radius=8, border_bottom_right_radius=8)
 
         text_padding = 15
-        full_menu_surf.blit(font.render("Settings", True, color_text), (text_padding, 8))
-        full_menu_surf.blit(font.render("Close Pet", True, color_text), (text_padding, button_height + 8))
-
-        src_rect = pygame.Rect(0, menu_full_height - int(input_handler.menu_anim_height),
-                               menu_width, int(input_handler.menu_anim_height))
-        current_menu_x, current_menu_y = input_handler.get_menu_render_position()
-        screen.blit(full_menu_surf, (current_menu_x, current_menu_y), src_rect)
+        layer.blit(font.render("Settings", True, color_text), (text_padding, 8))
+        layer.blit(font.render("Close Pet", True, color_text), (text_padding, button_height + 8))
+        self._menu_layers[hovered] = layer
+        return layer
 
     def draw_text_input(self, screen, x, y, text, cursor_pos, selection_start, selection_end,
                         drag_drop_cursor_pos, font, min_width=100, max_width=500, box_height=28):
         padding_y = 8
         padding_x = 8
 
+        widths = prefix_widths(font, text)
         if text:
-            text_width = font.size(text)[0] + padding_x * 2 + 10
+            text_width = widths.total + padding_x * 2 + 10
             box_width = max(min_width, min(text_width, max_width))
         else:
             box_width = min_width
@@ -85,9 +222,8 @@ class UI:
         pygame.draw.rect(screen, (255, 255, 255), rect, border_radius=6)
         pygame.draw.rect(screen, (200, 200, 200), rect, 1, border_radius=6)
 
-        text_surf = font.render(text, True, (0, 0, 0))
-        cursor_text = text[:cursor_pos]
-        cursor_offset = font.size(cursor_text)[0]
+        text_surf = self.text_cache.render(font, text, True, (0, 0, 0))
+        cursor_offset = widths.x_of(cursor_pos)
 
         scroll_x = 0
         available_width = box_width - padding_x * 2
@@ -101,8 +237,8 @@ class UI:
         if selection_start != selection_end:
             sel_start = min(selection_start, selection_end)
             sel_end = max(selection_start, selection_end)
-            prefix_width = font.size(text[:sel_start])[0]
-            selection_width = font.size(text[sel_start:sel_end])[0]
+            prefix_width = widths.x_of(sel_start)
+            selection_width = widths.span(sel_start, sel_end)
             highlight_rect = pygame.Rect(
                 rect.x + padding_x - scroll_x + prefix_width,
                 rect.centery - text_surf.get_height() // 2,
@@ -120,7 +256,7 @@ class UI:
             pygame.draw.line(screen, (0, 0, 0), (cursor_x, cursor_y_top), (cursor_x, cursor_y_bottom), 2)
 
         if drag_drop_cursor_pos != -1:
-            drop_x = rect.x + padding_x + font.size(text[:drag_drop_cursor_pos])[0] - scroll_x
+            drop_x = rect.x + padding_x + widths.x_of(drag_drop_cursor_pos) - scroll_x
             pygame.draw.line(screen, (100, 100, 255),
                              (drop_x, rect.centery - 12),
                              (drop_x, rect.centery + 12), 4)
@@ -137,9 +273,10 @@ class UI:
         return rect, render_info
 
     def draw_typing_indicator(self, screen, pet_x, pet_y, current_time):
-        bubble_width = 70
-        bubble_height = 40
-        tail_size = 12
+        """Draw the "thinking" bubble above the pet. Returns the drawn rect."""
+        bubble_width = TYPING_BUBBLE_WIDTH
+        bubble_height = TYPING_BUBBLE_HEIGHT
+        tail_size = TYPING_TAIL_SIZE
 
         bubble_x = pet_x - bubble_width // 2
         bubble_y = pet_y - self.pet_radius - bubble_height - tail_size // 2
@@ -149,6 +286,20 @@ class UI:
         if bubble_x + bubble_width > screen.get_width() - 5:
             bubble_x = screen.get_width() - bubble_width - 5
 
+        if self._typing_strip is None:
+            self._typing_strip = self._build_typing_strip()
+        phase = current_time * TYPING_DOT_SPEED / (2 * math.pi)
+        frame = int(phase * TYPING_FRAMES) % TYPING_FRAMES
+        area = (frame * bubble_width, 0, bubble_width, bubble_height + tail_size)
+        return screen.blit(self._typing_strip, (bubble_x, bubble_y), area)
+
+    @staticmethod
+    def _build_typing_strip():
+        """Render every frame of the typing animation side by side on one surface."""
+        bubble_width = TYPING_BUBBLE_WIDTH
+        bubble_height = TYPING_BUBBLE_HEIGHT
+        tail_size = TYPING_TAIL_SIZE
+
         bubble_surf = pygame.Surface((bubble_width, bubble_height + tail_size), pygame.SRCALPHA)
 
         body_rect = pygame.Rect(0, 0, bubble_width, bubble_height)
@@ -167,20 +318,39 @@ class UI:
         dot_spacing = 15
         dot_base_y = bubble_height // 2
 
-        speed = 0.008
-        phase = current_time * speed
-        offsets = [
-            math.sin(phase) * 6,
-            math.sin(phase + 2.094) * 6,
-            math.sin(phase + 4.188) * 6
-        ]
-
-        for i, offset in enumerate(offsets):
-            dot_x = bubble_width // 2 - dot_spacing + i * dot_spacing
-            dot_y = dot_base_y + offset
-            pygame.draw.circle(bubble_surf, (0, 0, 0), (dot_x, int(dot_y)), dot_radius)
+        strip = pygame.Surface((bubble_width * TYPING_FRAMES, bubble_height + tail_size),
+                               pygame.SRCALPHA)
+        for frame in range(TYPING_FRAMES):
+            frame_x = frame * bubble_width
+            strip.blit(bubble_surf, (frame_x, 0))
+            phase = 2 * math.pi * frame / TYPING_FRAMES
+            offsets = [
+                math.sin(phase) * 6,
+                math.sin(phase + 2.094) * 6,
+                math.sin(phase + 4.188) * 6
+            ]
+            for i, offset in enumerate(offsets):
+                dot_x = frame_x + bubble_width // 2 - dot_spacing + i * dot_spacing
+                dot_y = dot_base_y + offset
+                pygame.draw.circle(strip, (0, 0, 0), (dot_x, int(dot_y)), dot_radius)
+        return strip
+
+    def draw_queue_badge(self, screen, pet_x, pet_y, depth, font):
+        """
+        Draw a small badge with the number of queued prompts next to the pet.
 
-        screen.blit(bubble_surf, (bubble_x, bubble_y))
+        Returns:
+            The drawn rect, or None when nothing is queued.
+        """
+        if depth <= 0:
+            return None
+        badge_radius = 10
+        center_x = int(pet_x + self.pet_radius - badge_radius // 2)
+        center_y = int(pet_y - self.pet_radius + badge_radius // 2)
+        rect = pygame.draw.circle(screen, (0, 150, 255), (center_x, center_y), badge_radius)
+        pygame.draw.circle(screen, (255, 255, 255), (center_x, center_y), badge_radius, 2)
+        label = self.text_cache.render(font, str(depth), True, (255, 255, 255))
+        return rect.union(screen.blit(label, label.get_rect(center=(center_x, center_y))))
 
     # ------------------------------------------------------------------
     # Text box with selection support
@@ -202,106 +372,14 @@ class UI:
         font = base_font
         line_height = font.get_linesize()
 
-        # Helper to split a word that is too long
-        def split_word_to_fit(word, font, max_width):
-            """Break a word into chunks that each fit within max_width."""
-            if font.size(word)[0] <= max_width:
-                return [word]
-            chunks = []
-            current_chunk = ""
-            for ch in word:
-                test = current_chunk + ch
-                if font.size(test)[0] <= max_width:
-                    current_chunk = test
-                else:
-                    if current_chunk:
-                        chunks.append(current_chunk)
-                    current_chunk = ch
-            if current_chunk:
-                chunks.append(current_chunk)
-            return chunks
-
-        # Split text by newlines, preserving empty lines
-        paragraphs = text.split('\n')
-        # We need to build the final display lines and their starting character indices
-        lines = []                 # list of strings to display
-        line_start_indices = []    # character index of the first char of each line
-        char_count = 0             # total characters processed so far in original text
-
-        for para_idx, paragraph in enumerate(paragraphs):
-            # If paragraph is empty (i.e., we had a double newline), add a blank line
-            if paragraph == "":
-                lines.append("")
-                line_start_indices.append(char_count)  # blank line has start index at current position
-                # char_count does not increase because there are no characters
-                # But note: the newline character itself was already consumed in split, so we don't add it.
-                continue
-
-            # Wrap this paragraph using space-splitting + long-word breaking
-            words = paragraph.split(' ')
-            current_line = ""
-            for word in words:
-                # Check if word fits in current line
-                test_line = current_line + (" " if current_line else "") + word
-                if font.size(test_line)[0] <= box_width - 2 * padding:
-                    # It fits – add to current line
-                    if not current_line:
-                        # Starting a new line, record its start index
-                        line_start_indices.append(char_count)
-                    current_line = test_line
-                    # Update char_count (add space if needed, then word length)
-                    if current_line != word:   # we added a space
-                        char_count += 1        # space
-                    char_count += len(word)
-                else:
-                    # Word does not fit in current line
-                    if current_line:
-                        # Finish current line
-                        lines.append(current_line)
-                        current_line = ""
-                    # Now handle the word itself – it might need splitting
-                    # First, check if the word alone fits (with no preceding space)
-                    if font.size(word)[0] <= box_width - 2 * padding:
-                        # Word fits on its own line
-                        line_start_indices.append(char_count)
-                        current_line = word
-                        char_count += len(word)
-                    else:
-                        # Word is too long – split it
-                        chunks = split_word_to_fit(word, font, box_width - 2 * padding)
-                        for i, chunk in enumerate(chunks):
-                            line_start_indices.append(char_count)
-                            lines.append(chunk)
-                            char_count += len(chunk)
-                            # No trailing space after chunk
-                        current_line = ""   # after splitting, we start fresh for next word
-
-            # After processing all words in the paragraph, add the last line if any
-            if current_line:
-                lines.append(current_line)
-                # Its start index was already recorded when the line started
-
-            # After the paragraph, if this is not the last paragraph, we need to account for the newline character
-            # The newline itself is not part of the paragraph text, but we must increment char_count by 1
-            # so that the next paragraph's start index is correct.
-            if para_idx < len(paragraphs) - 1:
-                # There is a newline between paragraphs
-                char_count += 1  # the newline character
-
-        # If no lines at all (empty text), create a dummy line
-        if not lines:
-            lines = [""]
-            line_start_indices = [0]
-
-        # Ensure line_start_indices length matches lines
-        if len(line_start_indices) < len(lines):
-            # Fallback – should not happen, but just in case
-            # Fill missing start indices based on previous line
-            for i in range(len(line_start_indices), len(lines)):
-                # Approximate: start at previous line's start + length of previous line
-                prev_start = line_start_indices[i-1]
-                prev_line = lines[i-1]
-                line_start_indices.append(prev_start + len(prev_line))
+        # Wrapping is cached and only redone for text that changed
+        layout = self.text_box_layout
+        if layout is None or layout.font is not font or layout.width != box_width - 2 * padding:
+            layout = self.text_box_layout = TextLayout(font, box_width - 2 * padding,
+                                                       surface_cache=self.text_cache)
+        layout.set_text(text)
+        lines = layout.lines
+        line_start_indices = layout.line_starts
 
         # Calculate required height
         required_height = len(lines) * line_height + 2 * padding
@@ -350,21 +428,26 @@ class UI:
         pygame.draw.rect(screen, (255, 255, 255), rect, border_radius=8)
         pygame.draw.rect(screen, (0, 0, 0), rect, 2, border_radius=8)
 
+        # Only the lines inside the box are drawn
+        visible = layout.visible_range(scroll_offset - padding, box_height)
+
         # Draw selection highlight (if any)
         if self.text_box_selection_start != self.text_box_selection_end:
             sel_a = min(self.text_box_selection_start, self.text_box_selection_end)
             sel_b = max(self.text_box_selection_start, self.text_box_selection_end)
-            for idx, line in enumerate(lines):
+            for idx in visible:
                 line_start = line_start_indices[idx]
-                line_end = line_start_indices[idx+1] if idx+1 < len(line_start_indices) else len(text)
+                line_end = layout.line_end(idx)
                 if sel_a < line_end and sel_b > line_start:
                     overlap_start = max(sel_a, line_start)
                     overlap_end = min(sel_b, line_end)
                     # Prefix within line (before selection)
-                    prefix = text[line_start:overlap_start]
-                    selected_part = text[overlap_start:overlap_end]
-                    prefix_width = font.size(prefix)[0]
-                    selected_width = font.size(selected_part)[0]
+                    widths = layout.prefix_widths(idx)
+                    prefix_width = widths.x_of(overlap_start - line_start)
+                    selected_width = widths.span(overlap_start - line_start, overlap_end - line_start)
+                    if overlap_end > line_start + len(lines[idx]):
+                        # The selection continues past the break: show the space or newline
+                        selected_width += font.size(" ")[0]
                     y_pos = box_y + padding + idx * line_height - scroll_offset
                     if box_y <= y_pos < box_y + box_height - padding:
                         highlight_rect = pygame.Rect(
@@ -387,11 +470,10 @@ class UI:
         clip_rect = pygame.Rect(box_x, box_y, box_width, box_height)
         screen.set_clip(clip_rect)
 
-        for i, line in enumerate(lines):
+        for i in visible:
             y_pos = box_y + padding + i * line_height - scroll_offset
             if box_y <= y_pos < box_y + box_height - padding:
-                text_surf = font.render(line, True, (0, 0, 0))
-                screen.blit(text_surf, (box_x + padding, y_pos))
+                screen.blit(layout.surface(i), (box_x + padding, y_pos))
 
         screen.set_clip(None)
 
@@ -442,34 +524,10 @@ class UI:
 
     def _get_char_index_at_pos(self, pos, box_rect):
         """Convert screen position to character index in the text."""
-        if not self.text_box_lines or not self.text_box_font:
+        if self.text_box_layout is None or not self.text_box_lines:
             return 0
 
         # Local coordinates relative to box top-left, with scroll offset
         x = pos[0] - box_rect.x - self.text_box_padding
         y = pos[1] - box_rect.y + self.text_box_scroll_offset - self.text_box_padding
-
-        # Determine which line
-        line_idx = int(y // self.text_box_line_height)
-        if line_idx < 0:
-            return 0
-        if line_idx >= len(self.text_box_lines):
-            return len(self.text_box_text)
-
-        # Get the character range for this line
-        line_start = self.text_box_line_start_indices[line_idx]
-        line_end = (self.text_box_line_start_indices[line_idx+1]
-                    if line_idx+1 < len(self.text_box_line_start_indices)
-                    else len(self.text_box_text))
-        line_text = self.text_box_text[line_start:line_end]
-
-        # Find character within line based on x position
-        # Iterate through characters until cumulative width exceeds x
-        cumulative_width = 0
-        for i, ch in enumerate(line_text):
-            ch_width = self.text_box_font.size(ch)[0]
-            if cumulative_width + ch_width / 2 > x:  # use half‑width threshold
-                return line_start + i
-            cumulative_width += ch_width
-        # If we reach the end, return the index after the last character
-        return line_end
\ No newline at end of file
+        return self.text_box_layout.index_at(x, y)
@@ -0,0 +1,202 @@
+import json
+import os
+import sys
+import threading
+
+import numpy as np
+
+
+class VectorMemory:
+    """Long-term memory of past exchanges, searchable by embedding similarity.
+
+    Vectors are L2-normalized and stored in a memory-mapped float32 matrix
+    (one row per entry), so cosine similarity against every entry is a
+    single matrix-vector product. The texts live in a JSON-lines file next
+    to it, and both survive restarts.
+    """
+
+    def __init__(self, directory, dim=None, initial_capacity=1024):
+        """
+        Args:
+            directory: Folder holding vectors.f32, entries.jsonl and meta.json
+            dim: Embedding size; taken from the first added vector if None
+            initial_capacity: Rows reserved when the matrix is first created
+        """
+        self.directory = directory
+        self.dim = dim
+        self.initial_capacity = initial_capacity
+        self.count = 0
+        self.capacity = 0
+        self.texts = []
+        self._vectors = None
+        self._lock = threading.Lock()
+
+        self._vectors_path = os.path.join(directory, "vectors.f32")
+        self._entries_path = os.path.join(directory, "entries.jsonl")
+        self._meta_path = os.path.join(directory, "meta.json")
+        self._load()
+
+    def __len__(self):
+        return self.count
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+    def _load(self):
+        if not os.path.exists(self._meta_path):
+            return
+        try:
+            with open(self._meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            texts = self._read_texts()
+        except (OSError, ValueError, KeyError) as exc:
+            print(f"Could not load memory from {self.directory}: {exc}", file=sys.stderr)
+            return
+
+        self.dim = meta["dim"]
+        self.capacity = meta["capacity"]
+        # Rows and texts are written separately; trust whichever is shorter
+        self.count = min(meta["count"], len(texts))
+        self.texts = texts[:self.count]
+        if len(texts) != self.count:
+            # Drop the texts of entries that never made it into meta.json, or
+            # later appends would land after them and misalign rows and texts
+            self._rewrite_texts()
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r+",
+                                  shape=(self.capacity, self.dim))
+
+    def _read_texts(self):
+        """Read entries.jsonl, stopping at a line cut off by a crash."""
+        texts = []
+        with open(self._entries_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    texts.append(json.loads(line)["text"])
+                except (ValueError, KeyError):
+                    break
+        return texts
+
+    def _rewrite_texts(self):
+        tmp_path = self._entries_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for text in self.texts:
+                f.write(json.dumps({"text": text}, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self._entries_path)
+
+    def _save_meta(self):
+        data = {"dim": self.dim, "count": self.count, "capacity": self.capacity}
+        tmp_path = self._meta_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self._meta_path)
+
+    def _ensure_capacity(self, needed):
+        if self._vectors is not None and needed <= self.capacity:
+            return
+        new_capacity = max(self.initial_capacity, self.capacity)
+        while new_capacity < needed:
+            new_capacity *= 2
+
+        os.makedirs(self.directory, exist_ok=True)
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+        # Growing the file keeps existing rows in place
+        mode = "r+b" if os.path.exists(self._vectors_path) else "wb"
+        with open(self._vectors_path, mode) as f:
+            f.truncate(new_capacity * self.dim * 4)
+        self.capacity = new_capacity
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r+",
+                                  shape=(self.capacity, self.dim))
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm > 0 else vector
+
+    def add(self, vector, text, dedupe_threshold=0.98):
+        """
+        Store one entry.
+
+        Args:
+            vector: Embedding of text
+            text: The text to remember
+            dedupe_threshold: Skip entries this similar to an existing one
+
+        Returns:
+            True if the entry was stored, False if it was a near duplicate.
+        """
+        vector = self._normalize(vector)
+        with self._lock:
+            if self.dim is None:
+                self.dim = vector.shape[0]
+            if vector.shape[0] != self.dim:
+                raise ValueError(f"expected a {self.dim}-dim vector, got {vector.shape[0]}")
+
+            if self.count:
+                best = float(np.max(self._vectors[:self.count] @ vector))
+                if best >= dedupe_threshold:
+                    return False
+
+            self._ensure_capacity(self.count + 1)
+            self._vectors[self.count] = vector
+            with open(self._entries_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"text": text}, ensure_ascii=False) + "\n")
+            self.texts.append(text)
+            self.count += 1
+            self._save_meta()
+            return True
+
+    def search(self, vector, k=3, min_score=0.0):
+        """
+        Find the stored entries most similar to vector.
+
+        Returns:
+            List of (score, text) tuples, best match first.
+        """
+        with self._lock:
+            if not self.count or k <= 0:
+                return []
+            query = self._normalize(vector)
+            if query.shape[0] != self.dim:
+                return []
+            scores = self._vectors[:self.count] @ query
+            k = min(k, self.count)
+            # argpartition is O(n); only the k winners get sorted
+            top = np.argpartition(scores, -k)[-k:]
+            top = top[np.argsort(scores[top])[::-1]]
+            return [(float(scores[i]), self.texts[i]) for i in top if scores[i] >= min_score]
+
+    def flush(self):
+        """Write pending vector changes to disk."""
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors.flush()
+
+
+def format_memories(hits):
+    """Text block listing remembered facts, or "" when there are none."""
+    if not hits:
+        return ""
+    lines = "\n".join("- " + text for _, text in hits)
+    return "Things you remember from earlier conversations:\n" + lines
+
+
+def inject_memories(messages, hits):
+    """
+    Return a copy of messages with remembered facts placed before the last turn.
+
+    Args:
+        messages: Message list about to be sent to the model
+        hits: (score, text) tuples from VectorMemory.search
+    """
+    if not hits:
+        return list(messages)
+    memory_message = {"role": "system", "content": format_memories(hits)}
+    return list(messages[:-1]) + [memory_message] + list(messages[-1:])